@@ -7,8 +7,17 @@ from . import graph # Graph handling
 from . import adjacency # Computation of adjacency for graphs
 from . import dijkstra # Dijkstra's routing algorithm
 from . import bellman # Bellman's routing algorithm
+from . import johnson # Sparse all-pairs routing on CSR arrays
 from . import floyd_warshall
+from . import min_plus # Min-plus product routing for place-to-place studies
+from . import results # Dense storage of all-pairs results
 from . import routing # Routing objects
+from . import overlay # Copy-free scenario overlays on a shared graph
+from . import lanes # Routing several vehicles in one search
+from . import range_index # Distance-sorted adjacency for in-range edge slices
+from . import streaming # Per-origin result streaming to sinks
+from . import resilience # Incremental station-removal sweeps
+from . import soc # SOC-aware label-setting routing
 from . import rng # Creation of randomly generated objects
 from . import experiments # Setting up and rnning experimental cases
 from . import analysis
@@ -58,12 +58,16 @@ def dijkstra(graph, origins, **kwargs):
     values, savings = compare(values, approximation) - Function for comparing path state
     values with the existing best approximation at the target node. This function returns
     the values argument and a boolean savings.
+
+    neighbors - optional function of a node returning the (target, edge) pairs to be
+    considered out of it (see range_index.py). All out-edges are considered by default.
     '''
 
     destinations = kwargs.get('destinations', [])
     objective = kwargs.get('objective', Objective())
     return_paths = kwargs.get('return_paths', True)
     terminate_at_destinations = kwargs.get('terminate_at_destinations', True)
+    neighbors = kwargs.get('neighbors', None)
 
     infinity = objective.infinity()
 
@@ -121,7 +125,15 @@ def dijkstra(graph, origins, **kwargs):
 
             continue
 
-        for target, edge in edges[source].items():
+        if neighbors is None:
+
+            adjacency = edges[source].items()
+
+        else:
+
+            adjacency = neighbors(source)
+
+        for target, edge in adjacency:
 
             if edge.get('feasible', True):
 
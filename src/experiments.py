@@ -1,7 +1,17 @@
+import os
+import time
 import numpy as np
+import pandas as pd
 
+from .progress_bar import ProgressBar
 from .routing import Vehicle, Station, all_pairs_shortest_paths, supply_costs
-from .utilities import full_factorial
+from .routing import gravity, impedance
+from .results import AllPairsResults
+from .utilities import full_factorial, process_pool
+from .queuing import queuing_cache
+from .overlay import Overlay
+from .lanes import lane_all_pairs_shortest_paths
+from .range_index import RangeIndex
 
 _vehicle_kwargs = {
     'capacity': lambda rng: (rng.random() * 80 + 40) * 3.6e6,
@@ -76,19 +86,521 @@ def generate_case(graphs, vehicle_param, station_param, rng = np.random.default_
     return graph_index, vehicle_kw, station_kw
 
 
-def run_case(graph, vehicle_kw, station_kw, method = 'dijkstra'):
+def run_case(
+    graph, vehicle_kw, station_kw, method = 'dijkstra', queue_cache = queuing_cache,
+    overlay = False, range_index = False,
+    ):
+    '''
+    Routes between all places for one vehicle and station configuration
+
+    If overlay is True stations and costs are kept in an Overlay and graph is not
+    modified so that many cases can be evaluated on one in-memory graph. If
+    range_index is True out-of-range edges are skipped using a RangeIndex
+    '''
 
     vehicle = Vehicle(**vehicle_kw)
 
+    # Queuing time distributions are shared between cases through queue_cache
+    station_kw = {k: {'queue_cache': queue_cache, **v} for k, v in station_kw.items()}
+
     origins = [k for k, v in graph._node.items() if v['type'] == 'place']
 
-    graph = supply_costs(graph, vehicle, station_kw)
+    if overlay:
+
+        graph = Overlay(graph, station_kw, vehicle)
+
+    else:
+
+        graph = supply_costs(graph, vehicle, station_kw)
     
+    kwargs = {}
+
+    if range_index:
+
+        kwargs['neighbors'] = RangeIndex(graph).neighbors(vehicle)
+
     costs, values, paths = all_pairs_shortest_paths(
         graph, origins,
         objective = vehicle,
         method = method,
         progress_bar_kw = {'disp': False},
+        **kwargs,
     )
 
-    return costs, values, paths
\ No newline at end of file
+    return costs, values, paths
+
+def run_fleet_case(graph, vehicle_kws, station_kw, queue_cache = queuing_cache):
+    '''
+    Routes between all places for several vehicles sharing one station configuration
+
+    Vehicles are routed together as lanes (see lanes.py) on an Overlay of graph.
+    Returns a list with one (costs, values, paths) tuple per vehicle and a dictionary
+    with the number of lanes and of searches run.
+    '''
+
+    vehicles = [Vehicle(**vehicle_kw) for vehicle_kw in vehicle_kws]
+
+    station_kw = {k: {'queue_cache': queue_cache, **v} for k, v in station_kw.items()}
+
+    origins = [k for k, v in graph._node.items() if v['type'] == 'place']
+
+    return lane_all_pairs_shortest_paths(
+        Overlay(graph, station_kw), origins, vehicles,
+        progress_bar_kw = {'disp': False},
+        )
+
+def flatten_parameters(vehicle_kw, station_kw):
+    '''
+    Flattens case parameters into a dictionary of scalars
+
+    Vehicle parameters are prefixed with vehicle_ and station parameters with the node
+    type. Array parameters are expanded with an index suffix. Non-scalar parameters
+    (dictionaries, generators) are omitted.
+    '''
+
+    flat = {}
+
+    groups = [('vehicle', vehicle_kw)] + list(station_kw.items())
+
+    for prefix, kw in groups:
+
+        for key, value in kw.items():
+
+            if isinstance(value, (bool, int, float, str, np.number, np.bool_)):
+
+                flat[f'{prefix}_{key}'] = value
+
+            elif isinstance(value, (list, tuple, np.ndarray)):
+
+                value = np.atleast_1d(value)
+
+                if value.dtype.kind in 'biuf':
+
+                    for idx, v in enumerate(value):
+
+                        flat[f'{prefix}_{key}_{idx}'] = v
+
+    return flat
+
+def summarize_case(values):
+    '''
+    Summary outputs of a case used by run_experiment and run_design
+
+    Values are summarized from an AllPairsResults container in which unreachable
+    place pairs take infinite values so that impedance is infinite and gravity is
+    reduced rather than the case failing
+    '''
+
+    if not isinstance(values, AllPairsResults):
+
+        values = AllPairsResults.from_nested(
+            None, values, destinations = list(values.keys())
+            )
+
+    return {
+        'impedance_total_time': impedance(values, field = 'total_time'),
+        'impedance_driving_time': impedance(values, field = 'driving_time'),
+        'impedance_routing_time': impedance(values, field = 'routing_time'),
+        'gravity_total_time': gravity(values, field = 'total_time'),
+    }
+
+# Worker-local state for parallel experiments
+_runner = {}
+
+def _initialize_runner(graphs, kwargs):
+
+    _runner['graphs'] = graphs
+    _runner['kwargs'] = kwargs
+
+def _run_generated_case(item):
+
+    case_id, graph_index, vehicle_kw, station_kw = item
+
+    kwargs = _runner['kwargs']
+
+    row = {
+        'case_id': case_id,
+        'graph_index': graph_index,
+        **flatten_parameters(vehicle_kw, station_kw),
+        }
+
+    t0 = time.time()
+
+    # A failing case is recorded as a row with its error instead of stopping the run
+    try:
+
+        costs, values, paths = run_case(
+            _runner['graphs'][graph_index], vehicle_kw, station_kw,
+            method = kwargs.get('method', 'dijkstra'),
+            overlay = kwargs.get('overlay', False),
+            )
+
+        row.update(kwargs.get('summary', summarize_case)(values))
+
+        row['error'] = ''
+
+    except Exception as error:
+
+        row['error'] = repr(error)
+
+    row['run_time'] = time.time() - t0
+
+    return row
+
+def completed_cases(filename):
+    '''
+    Returns the case ids and the seed entropy recorded in a results file
+    '''
+
+    if not os.path.isfile(filename):
+
+        return set(), None
+
+    df = pd.read_csv(filename, usecols = ['case_id', 'entropy'], dtype = str)
+
+    entropy = int(df['entropy'].iloc[0]) if len(df) > 0 else None
+
+    return set(df['case_id'].astype(int)), entropy
+
+def run_experiment(graphs, cases, filename, **kwargs):
+    '''
+    Runs randomly generated cases across a process pool and appends each case's
+    parameters and summary outputs to a CSV file as it finishes
+
+    args:
+
+    graphs - list of graphs from which generate_case draws
+    cases - number of cases
+    filename - CSV file of results, one row per case. Cases whose case_id is already in
+    the file are skipped so that an interrupted experiment resumes where it stopped.
+    Cases which raise are recorded with the exception in the error column and without
+    outputs. Their rows must be removed for them to be run again.
+
+    kwargs:
+
+    seed - entropy for the SeedSequence from which each case's generator is spawned.
+    Case i always receives the i-th child so results do not depend on the number of
+    processes or on restarts. If not provided the entropy recorded in filename is used
+    if present, otherwise fresh entropy is drawn and recorded
+    processes - number of worker processes
+    vehicle_param, station_param - see generate_case
+    method - routing method passed to run_case
+    overlay - passed to run_case (default False as in run_case). Results are the same
+    either way but if True graphs are not modified
+    summary - function of values returning a dictionary of summary outputs
+    progress_bar_kw - kwargs for the progress bar
+
+    returns the ids of the cases run
+    '''
+
+    seed = kwargs.get('seed', None)
+    processes = kwargs.get('processes', 1)
+    vehicle_param = kwargs.get('vehicle_param', _vehicle_kwargs)
+    station_param = kwargs.get('station_param', _station_kwargs)
+    progress_bar_kw = kwargs.get('progress_bar_kw', {})
+
+    completed, entropy = completed_cases(filename)
+
+    if seed is None:
+
+        seed = entropy
+
+    seed_sequence = np.random.SeedSequence(seed)
+
+    children = seed_sequence.spawn(cases)
+
+    # Cases are generated in the parent so that lambdas in the parameters are not pickled
+    items = []
+
+    for case_id in range(cases):
+
+        if case_id in completed:
+
+            continue
+
+        rng = np.random.default_rng(children[case_id])
+
+        graph_index, vehicle_kw, station_kw = generate_case(
+            graphs, vehicle_param, station_param, rng
+            )
+
+        items.append((case_id, graph_index, vehicle_kw, station_kw))
+
+    run_kw = {k: kwargs[k] for k in ('method', 'overlay', 'summary') if k in kwargs}
+
+    columns = None
+
+    if os.path.isfile(filename):
+
+        columns = list(pd.read_csv(filename, nrows = 0).columns)
+
+    case_ids = []
+
+    pool = None
+
+    try:
+
+        if processes > 1:
+
+            pool = process_pool(processes, _initialize_runner, (graphs, run_kw))
+
+        else:
+
+            _initialize_runner(graphs, run_kw)
+
+        if pool is None:
+
+            rows = map(_run_generated_case, items)
+
+        else:
+
+            rows = pool.imap_unordered(_run_generated_case, items)
+
+        for _ in ProgressBar(list(range(len(items))), **progress_bar_kw):
+
+            row = next(rows)
+
+            row['entropy'] = str(seed_sequence.entropy)
+
+            df = pd.DataFrame([row])
+
+            if columns is None:
+
+                columns = list(df.columns)
+
+                df.to_csv(filename, index = False)
+
+            elif not set(df.columns) <= set(columns):
+
+                # Rows written before the first successful case lack its outputs
+                columns += [c for c in df.columns if c not in columns]
+
+                pd.concat([pd.read_csv(filename, dtype = str), df]).reindex(
+                    columns = columns
+                    ).to_csv(filename, index = False)
+
+            else:
+
+                df.reindex(columns = columns).to_csv(
+                    filename, mode = 'a', header = False, index = False
+                    )
+
+            case_ids.append(row['case_id'])
+
+    finally:
+
+        if pool is not None:
+
+            pool.terminate()
+
+        _runner.clear()
+
+    return case_ids
+
+def run_design(graphs, factors, **kwargs):
+    '''
+    Runs a full-factorial design sharing preprocessing between design points
+
+    Design points are grouped by their graph and station factors. Edge types and
+    stations are built once per group in an Overlay and only the edge costs and
+    routing are redone for each combination of vehicle factors within the group.
+
+    args:
+
+    graphs - list of graphs
+    factors - dictionary of {name: levels}. The name 'graph' selects the graph index,
+    names 'vehicle.<param>' set Vehicle kwargs, and names '<node type>.<param>' set
+    Station kwargs for stations of that node type
+
+    kwargs:
+
+    vehicle_kw, station_kw - base parameters which factors are applied to. Drawn with
+    generate_case from the default parameters if not provided
+    seed - seed for the base parameters and for each group's station generator
+    method - routing method
+    routing_kw - additional kwargs for all_pairs_shortest_paths (e.g. processes)
+    summary - function of values returning a dictionary of summary outputs
+    queue_cache - QueuingCache shared by all stations
+    filename - if provided results are written to this CSV file
+    progress_bar_kw - kwargs for the progress bar
+    common_random_numbers - if True (default) the station generator of a group is
+    reset before each design point so that points differing only in vehicle factors
+    see the same station delay draws (see lanes.fleet_edge_costs)
+
+    returns a DataFrame with one row per design point and a dictionary of the total
+    time spent in each stage (stations, costs, routing, summary). Station delay
+    sampling is counted under stations. Design points which raise are recorded with
+    the exception in the error column and without outputs or stage times.
+    '''
+
+    seed = kwargs.get('seed', None)
+    vehicle_kw = kwargs.get('vehicle_kw', None)
+    station_kw = kwargs.get('station_kw', None)
+    method = kwargs.get('method', 'dijkstra')
+    routing_kw = kwargs.get('routing_kw', {})
+    summary = kwargs.get('summary', summarize_case)
+    queue_cache = kwargs.get('queue_cache', queuing_cache)
+    filename = kwargs.get('filename', None)
+    progress_bar_kw = kwargs.get('progress_bar_kw', {})
+    common_random_numbers = kwargs.get('common_random_numbers', True)
+
+    seed_sequence = np.random.SeedSequence(seed)
+
+    if (vehicle_kw is None) or (station_kw is None):
+
+        _, vkw, skw = generate_case(
+            [0], _vehicle_kwargs, _station_kwargs,
+            np.random.default_rng(seed_sequence.spawn(1)[0]),
+            )
+
+        vehicle_kw = vkw if vehicle_kw is None else vehicle_kw
+        station_kw = skw if station_kw is None else station_kw
+
+    names = list(factors.keys())
+
+    design = full_factorial([len(factors[name]) for name in names])
+
+    shared = [idx for idx, name in enumerate(names) if not name.startswith('vehicle.')]
+
+    groups = {}
+
+    for point, row in enumerate(design):
+
+        groups.setdefault(tuple(row[shared]), []).append(point)
+
+    group_seeds = dict(zip(groups.keys(), seed_sequence.spawn(len(groups))))
+
+    work = [(key, point) for key, points in groups.items() for point in points]
+
+    timings = {'stations': 0., 'costs': 0., 'routing': 0., 'summary': 0.}
+
+    rows = []
+
+    current = None
+
+    for key, point in ProgressBar(work, **progress_bar_kw):
+
+        levels = {
+            name: factors[name][design[point][idx]] for idx, name in enumerate(names)
+            }
+
+        # Edge types and stations are built once per group of shared factors
+        if key != current:
+
+            t0 = time.time()
+
+            graph = graphs[levels.get('graph', 0)]
+
+            rng = np.random.default_rng(group_seeds[key])
+
+            group_station_kw = {
+                k: {**v, 'queue_cache': queue_cache, 'rng': rng}
+                for k, v in station_kw.items()
+                }
+
+            for name, level in levels.items():
+
+                prefix, _, param = name.partition('.')
+
+                if prefix in group_station_kw:
+
+                    group_station_kw[prefix][param] = level
+
+            overlay = Overlay(graph, group_station_kw)
+
+            origins = [k for k, v in graph._node.items() if v['type'] == 'place']
+
+            stations = [
+                node['station'] for node in overlay.node_attributes.values()
+                if node['station'] is not None
+                ]
+
+            states = [station.rng.bit_generator.state for station in stations]
+
+            timings['stations'] += time.time() - t0
+
+            current = key
+
+        point_vehicle_kw = {**vehicle_kw}
+
+        for name, level in levels.items():
+
+            prefix, _, param = name.partition('.')
+
+            if prefix == 'vehicle':
+
+                point_vehicle_kw[param] = level
+
+        t0 = time.time()
+
+        vehicle = Vehicle(**point_vehicle_kw)
+
+        if common_random_numbers:
+
+            for station, state in zip(stations, states):
+
+                station.rng.bit_generator.state = state
+
+        # Station delays are sampled here so that overlay.cost only computes costs
+        for station in stations:
+
+            station.vehicle = vehicle
+
+            station.estimate()
+
+        timings['stations'] += time.time() - t0
+
+        row = {'design_point': point}
+
+        for name, level in levels.items():
+
+            row[name] = level if np.isscalar(level) else str(list(level))
+
+        t0 = time.time()
+        t1 = t2 = t3 = None
+
+        # A failing design point is recorded with its error instead of stopping the run
+        try:
+
+            overlay.cost(vehicle)
+
+            t1 = time.time()
+
+            costs, values, paths = all_pairs_shortest_paths(
+                overlay, origins,
+                objective = vehicle,
+                method = method,
+                progress_bar_kw = {'disp': False},
+                **routing_kw,
+                )
+
+            t2 = time.time()
+
+            row.update(summary(values))
+
+            t3 = time.time()
+
+            row['error'] = ''
+
+        except Exception as error:
+
+            row['error'] = repr(error)
+
+        if t3 is not None:
+
+            timings['costs'] += t1 - t0
+            timings['routing'] += t2 - t1
+            timings['summary'] += t3 - t2
+
+            row['costs_time'] = t1 - t0
+            row['routing_time'] = t2 - t1
+
+        rows.append(row)
+
+    df = pd.DataFrame(rows).sort_values('design_point').reset_index(drop = True)
+
+    if filename is not None:
+
+        df.to_csv(filename, index = False)
+
+    return df, timings
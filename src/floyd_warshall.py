@@ -30,6 +30,20 @@ def floyd_warshall(graph, fields, **kwargs):
     tolerance - float threshold of disambiguation for selecting alterante paths
 
     if a non-zero tolerance is provided then alternate paths may be produced
+
+    alternative_tolerance - threshold against the optimal cost above which alternate
+    routes are discarded. Defaults to 10 * tolerance.
+
+    max_alternatives - number of alternate predecessors kept per pair (default 4)
+
+    max_paths - number of alternate paths recovered per pair (default 10)
+
+    carry_fields - if True secondary fields are relaxed alongside the primary field
+    inside the kernel and values are returned as an (n, n, n_fields) array ordered as
+    fields rather than as nested dictionaries
+
+    return_paths - if False paths are not recovered (only applies when carry_fields
+    is True)
     '''
 
     # Creating adjacency matrices
@@ -43,9 +57,44 @@ def floyd_warshall(graph, fields, **kwargs):
     destinations = kwargs.get('destinations', list(range(n)))
     pivots = kwargs.get('pivots', list(range(n)))
     tolerance = kwargs.get('tolerance', 0)
+    carry_fields = kwargs.get('carry_fields', False)
+    return_paths = kwargs.get('return_paths', True)
+
+    if (tolerance == 0) and carry_fields: # Relax all fields in the kernel
 
-    
-    if tolerance == 0: # Only store optimal routes
+        adjacency_fields = np.stack([adjacency[f] for f in fields], axis = -1)
+
+        # Running the Floyd Warshall algorithm
+        values = np.zeros_like(adjacency_fields)
+        predecessors = np.zeros_like(adjacency_primary, dtype = int)
+
+        values, predecessors = _floyd_warshall_fields(
+            adjacency_fields,
+            pivots,
+            values,
+            predecessors,
+        )
+
+        costs = values[:, :, 0]
+
+        # Paths are only recovered on request
+        paths = None
+
+        if return_paths:
+
+            paths = {}
+
+            for origin in origins:
+
+                paths[origin] = {}
+
+                for destination in destinations:
+
+                    paths[origin][destination] = recover_path(
+                        predecessors, origin, destination
+                        )
+
+    elif tolerance == 0: # Only store optimal routes
 
         # Running the Floyd Warshall algorithm
         costs = np.zeros_like(adjacency_primary)
@@ -81,20 +130,25 @@ def floyd_warshall(graph, fields, **kwargs):
 
     else: # Search for alternate routes within threshold of disambiguation
 
+        alternative_tolerance = kwargs.get('alternative_tolerance', tolerance * 10)
+        max_alternatives = kwargs.get('max_alternatives', 4)
+        max_paths = kwargs.get('max_paths', 10)
+
         # Running the Floyd Warshall algorithm
         costs = np.zeros_like(adjacency_primary)
         predecessors = np.zeros_like(adjacency_primary, dtype = int)
+        alternatives = -np.ones((n, n, max_alternatives), dtype = int)
+        alternative_costs = np.full((n, n, max_alternatives), np.inf)
 
-        costs, predecessors, store = _floyd_warshall_multi(
+        costs, predecessors, alternatives, alternative_costs = _floyd_warshall_multi(
             adjacency_primary,
             pivots,
             costs,
             predecessors,
+            alternatives,
+            alternative_costs,
             tolerance = tolerance,
-        )
-
-        extended = extended_predecessors(
-            costs, predecessors, store, tolerance = tolerance * 10
+            alternative_tolerance = alternative_tolerance,
         )
 
         # Recovering paths and values
@@ -109,7 +163,12 @@ def floyd_warshall(graph, fields, **kwargs):
             for destination in destinations:
 
                 path = recover_paths(
-                    extended, origin, destination
+                    adjacency_primary, costs, predecessors, alternatives,
+                    origin, destination,
+                    max_paths = max_paths,
+                    max_cost = (
+                        (1 + alternative_tolerance) * costs[origin][destination]
+                        ),
                     )
 
                 paths[origin][destination] = path
@@ -134,11 +193,11 @@ def recover_path(predecessors, origin, destination):
     while (origin != destination) and (idx <= max_iterations):
 
         destination = predecessors[origin][destination]
-        path = [destination] + path
+        path.append(destination)
 
         idx +=1
 
-    return path
+    return path[::-1]
 
 def recover_path_costs(adjacency, path):
     '''
@@ -186,20 +245,69 @@ def _floyd_warshall(adjacency, pivots, costs, predecessors):
     return costs, predecessors
 
 @jit(nopython = True, cache = True)
-def _floyd_warshall_multi(adjacency, pivots, costs, predecessors, tolerance = .05):
+def _floyd_warshall_fields(adjacency, pivots, values, predecessors):
+    '''
+    Implementation of Floyd Warshall algorithm
+    https://en.wikipedia.org/wiki/Floyd%E2%80%93Warshall_algorithm
+
+    This implementation routes on the first field of the (n, n, n_fields) adjacency
+    and carries the remaining fields through each improving relaxation so that path
+    values do not have to be recovered afterward
+    '''
+
+    n, _, n_fields = adjacency.shape
+
+    # Creating initial approximations
+    for source in range(n):
+        for target in range(n):
+            for field in range(n_fields):
+
+                values[source][target][field] = adjacency[source][target][field]
+
+            predecessors[source][target] = source
+
+    # Updating approximations
+    for pivot in pivots:
+        for source in range(n):
+            for target in range(n):
+
+                # if source-pivot-target is lower cost than source-target then update
+                if (
+                    values[source][pivot][0] + values[pivot][target][0] <
+                    values[source][target][0]
+                    ):
+
+                    for field in range(n_fields):
+
+                        values[source][target][field] = (
+                            values[source][pivot][field] + values[pivot][target][field]
+                            )
+
+                    predecessors[source][target] = predecessors[pivot][target]
+
+    return values, predecessors
+
+@jit(nopython = True, cache = True)
+def _floyd_warshall_multi(
+    adjacency, pivots, costs, predecessors, alternatives, alternative_costs,
+    tolerance = .05, alternative_tolerance = .5,
+    ):
     '''
     Implementation of Floyd Warshall algorithm
     https://en.wikipedia.org/wiki/Floyd%E2%80%93Warshall_algorithm
 
-    This implementation stores some sub-optimal approximations in order to
-    produce alternate paths
+    This implementation stores up to k near-optimal alternative predecessors per pair
+    in the preallocated (n, n, k) arrays alternatives and alternative_costs in order to
+    produce alternate paths. Candidates are stored if their cost is within tolerance
+    of the current approximation and are kept while their cost is within
+    alternative_tolerance of it. Empty slots are marked with -1 and infinite cost.
     '''
 
     tolerance += 1.
+    alternative_tolerance += 1.
 
     n = len(adjacency)
-
-    store = [] # List for storing non-optimal approximations
+    k = alternatives.shape[2]
 
     # Creating initial approximations
     for source in range(n):
@@ -211,89 +319,148 @@ def _floyd_warshall_multi(adjacency, pivots, costs, predecessors, tolerance = .0
             costs[source][target] = adjacency[source][target]
             predecessors[source][target] = source
 
+            for idx in range(k):
+
+                alternatives[source][target][idx] = -1
+                alternative_costs[source][target][idx] = np.inf
+
     # Updating approximations
     for pivot in pivots:
         for source in range(n):
             for target in range(n):
 
                 costs_new = costs[source][pivot] + costs[pivot][target]
+                predecessor_new = predecessors[pivot][target]
 
-                # if source-pivot-target is lower cost than source-target then update
                 if costs_new < costs[source][target]:
 
-                    # If the difference is less than the threshold of disambiguation
-                    # then store the previous approximation
-                    if costs[source][target] < min([tolerance * costs_new, np.inf]):
+                    # The previous approximation becomes a candidate alternative
+                    candidate = predecessors[source][target]
+                    candidate_cost = costs[source][target]
 
-                        store.append(
-                            (
-                                source, target,
-                                predecessors[source][target],
-                                costs[source][target],
-                                )
-                            )
+                    costs[source][target] = costs_new
+                    predecessors[source][target] = predecessor_new
 
-                    costs[source][target] = costs[source][pivot] + costs[pivot][target]
-                    predecessors[source][target] = predecessors[pivot][target]
+                    # Dropping alternatives which are no longer near-optimal
+                    for idx in range(k):
 
-    return costs, predecessors, store
+                        if (
+                            (alternative_costs[source][target][idx] >=
+                                alternative_tolerance * costs_new) or
+                            (alternatives[source][target][idx] == predecessor_new)
+                            ):
 
-def extended_predecessors(costs, predecessors, store, tolerance = .05):
-    '''
-    Computes a multi-predecessors dictionary to allow for alternative routing
-    '''
+                            alternatives[source][target][idx] = -1
+                            alternative_costs[source][target][idx] = np.inf
 
-    tolerance += 1.
+                else:
 
-    n = len(costs)
+                    # Non-improving approximations may also be near-optimal
+                    candidate = predecessor_new
+                    candidate_cost = costs_new
 
-    extended = {}
+                # If the difference is less than the threshold of disambiguation
+                # then store the candidate in place of the worst stored alternative
+                if (
+                    (candidate_cost < tolerance * costs[source][target]) and
+                    (candidate != predecessors[source][target])
+                    ):
 
-    for source in range(n):
+                    worst = 0
+                    duplicate = False
 
-        extended[source] = {}
+                    for idx in range(k):
 
-        for target in range(n):
+                        if alternatives[source][target][idx] == candidate:
+
+                            duplicate = True
+
+                            if candidate_cost < alternative_costs[source][target][idx]:
 
-            extended[source][target] = {predecessors[source][target]}
+                                alternative_costs[source][target][idx] = candidate_cost
 
-    for predecessor in store:
+                            break
 
-        s, t, p, c = predecessor
+                        if (
+                            alternative_costs[source][target][idx] >
+                            alternative_costs[source][target][worst]
+                            ):
 
-        if c <= tolerance * costs[s][t]:
+                            worst = idx
 
-            extended[s][t].add(p)
+                    if (
+                        (not duplicate) and
+                        (candidate_cost < alternative_costs[source][target][worst])
+                        ):
 
-    return extended
+                        alternatives[source][target][worst] = candidate
+                        alternative_costs[source][target][worst] = candidate_cost
 
-def recover_paths(predecessors, origin, destination):
+    return costs, predecessors, alternatives, alternative_costs
+
+def recover_paths(
+    adjacency, costs, predecessors, alternatives, origin, destination,
+    max_paths = 10, max_cost = np.inf, max_iterations = 10000,
+    ):
     '''
     Recovers multiple branching path alternatives
+
+    Partial paths are expanded backward from destination in order of their lowest
+    achievable cost so paths are returned cheapest first. Enumeration stops when
+    max_paths paths have been found, when no partial path can be completed for less
+    than max_cost, or after max_iterations expansions. Cyclic paths are discarded.
+
+    This replaces recover_paths(predecessors, origin, destination) over the
+    multi-predecessor dictionary of the removed extended_predecessors.
     '''
 
+    if origin == destination:
+
+        return [[origin]]
+
     paths = []
 
     heap = []
 
     c = count()
 
-    heappush(heap, (next(c), [destination]))
+    heappush(heap, (costs[origin][destination], next(c), 0., [destination]))
+
+    iteration = 0
+
+    while heap and (len(paths) < max_paths) and (iteration < max_iterations):
+
+        _, _, suffix_cost, path = heappop(heap)
+
+        iteration += 1
+
+        head = path[0]
+
+        if head == origin:
+
+            paths.append(path)
+
+            continue
+
+        candidates = [int(predecessors[origin][head])]
+
+        for predecessor in alternatives[origin][head]:
 
-    while heap:
+            if (predecessor >= 0) and (predecessor not in candidates):
 
-        _, path = heappop(heap)
+                candidates.append(int(predecessor))
 
-        destinations = predecessors[origin][path[0]]
+        for predecessor in candidates:
 
-        for destination in destinations:
+            if predecessor in path:
 
-            if destination == origin:
+                continue
 
-                paths.append([destination] + path)
+            cost = suffix_cost + adjacency[predecessor][head]
+            bound = costs[origin][predecessor] + cost
 
-            else:
+            if bound <= max_cost:
 
-                heappush(heap, (c, [destination] + path))
+                heappush(heap, (bound, next(c), cost, [predecessor] + path))
 
     return paths
\ No newline at end of file
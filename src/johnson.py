@@ -0,0 +1,392 @@
+'''
+Module for Johnson-style sparse all-pairs routing
+
+Edge costs are produced by the Objective object, packed into Compressed Sparse Row
+(CSR) arrays, and routed with a compiled Dijkstra run once per origin. If any edge
+cost is negative the edges are first reweighted using potentials from a compiled
+Bellman-Ford run (Johnson's algorithm). Infeasible edges are omitted from the CSR so
+sparse, distance-limited SNGs are routed without visiting them.
+
+The compiled engine requires an additive scalar objective: the cost of a path must be
+the sum of the costs of its edges. This is the case for Objective and for Vehicle with
+cases = 1 but not for Vehicle with multiple cases (super-quantile expectations).
+The same requirement applies to the engines built on the compiled Dijkstra here
+(lanes.py and resilience.py). Where several routes tie, the route returned by these
+engines may differ from the one returned by dijkstra but its cost is the same.
+
+Paths found on the scalar edge costs are replayed through the objective to produce
+their values. Path-level limits such as path_limit are only checked on replay so a
+path which fails them is rerouted with the objective-driven dijkstra (see
+route_infeasible) which may find a feasible alternative.
+'''
+import heapq
+
+import numpy as np
+
+from numba import jit
+
+from .progress_bar import ProgressBar
+from .dijkstra import dijkstra
+
+def csr_from_graph(graph, objective, neighbors = None):
+    '''
+    Packs the feasible edges of graph into CSR arrays of scalar edge costs
+
+    The cost of an edge is the cost of the single-edge path as computed by the
+    objective's update and compare functions. If neighbors is provided only the
+    (target, edge) pairs it returns for each node are considered (see range_index.py).
+    Returns the list of nodes, a node to index dictionary, and the CSR indptr, indices,
+    and weights arrays.
+    '''
+
+    nodes = list(graph._node.keys())
+    index = {node: idx for idx, node in enumerate(nodes)}
+
+    infinity = objective.infinity()
+
+    indptr = np.zeros(len(nodes) + 1, dtype = np.int64)
+    indices = []
+    weights = []
+
+    for idx, source in enumerate(nodes):
+
+        if neighbors is None:
+
+            adjacency = graph._adj[source].items()
+
+        else:
+
+            adjacency = neighbors(source)
+
+        for target, edge in adjacency:
+
+            if not edge.get('feasible', True):
+
+                continue
+
+            values, feasible = objective.update(objective.initial(), edge)
+
+            if not feasible:
+
+                continue
+
+            cost, _ = objective.compare(values, infinity)
+
+            indices.append(index[target])
+            weights.append(cost)
+
+        indptr[idx + 1] = len(indices)
+
+    indices = np.array(indices, dtype = np.int64)
+    weights = np.array(weights, dtype = np.float64)
+
+    return nodes, index, indptr, indices, weights
+
+def johnson(graph, origins, **kwargs):
+    '''
+    Sparse all-pairs routing via compiled repeated Dijkstra over CSR arrays
+
+    Collects the results of iter_johnson. See iter_johnson for kwargs.
+
+    Returns costs, values, and paths as nested dictionaries keyed by origin and then
+    destination in the same format as routing.all_pairs_shortest_paths.
+    '''
+
+    costs = {}
+    values = {}
+    paths = {}
+
+    for origin, origin_costs, origin_values, origin_paths in iter_johnson(
+        graph, origins, **kwargs
+        ):
+
+        costs[origin] = origin_costs
+        values[origin] = origin_values
+        paths[origin] = origin_paths
+
+    if not kwargs.get('return_paths', True):
+
+        paths = None
+
+    return costs, values, paths
+
+def iter_johnson(graph, origins, **kwargs):
+    '''
+    Sparse all-pairs routing via compiled repeated Dijkstra over CSR arrays
+
+    kwargs:
+
+    objective - additive scalar Objective object (see routing.shortest_paths)
+    destinations - nodes for which results are returned, defaults to origins
+    return_paths - if False paths are not returned
+    terminate_at_destinations - if True routes may not pass through destinations
+    reweight - 'auto', True, or False. If True (or 'auto' and a negative edge cost is
+    present) edges are reweighted with Bellman-Ford potentials before routing
+    neighbors - optional function of a node returning the (target, edge) pairs to be
+    considered out of it (see range_index.py)
+
+    Destinations whose compiled path fails the objective on replay are rerouted with
+    route_infeasible.
+
+    Yields (origin, costs, values, paths) for each origin with costs, values, and paths
+    as dictionaries keyed by destination (paths is None if return_paths is False)
+    '''
+
+    objective = kwargs['objective']
+    destinations = kwargs.get('destinations', origins)
+    return_paths = kwargs.get('return_paths', True)
+    terminate_at_destinations = kwargs.get('terminate_at_destinations', True)
+    reweight = kwargs.get('reweight', 'auto')
+
+    if getattr(objective, 'cases', 1) > 1:
+
+        raise ValueError(
+            'johnson requires an additive scalar objective (cases = 1)'
+            )
+
+    nodes, index, indptr, indices, weights = csr_from_graph(
+        graph, objective, kwargs.get('neighbors', None)
+        )
+
+    n = len(nodes)
+
+    if reweight == 'auto':
+
+        reweight = bool((weights < 0).any())
+
+    potentials = np.zeros(n)
+
+    if reweight:
+
+        potentials, negative_cycle = _bellman_ford_csr(indptr, indices, weights)
+
+        if negative_cycle:
+
+            raise ValueError('Negative cycle found!')
+
+        weights = weights + potentials[np.repeat(np.arange(n), np.diff(indptr))]
+        weights = weights - potentials[indices]
+
+        # Reweighted costs are non-negative up to round-off
+        weights = np.clip(weights, 0, np.inf)
+
+    terminal = np.zeros(n, dtype = np.bool_)
+
+    if terminate_at_destinations:
+
+        terminal[[index[d] for d in destinations]] = True
+
+    infinity = objective.infinity()
+
+    for origin in ProgressBar(origins, **kwargs.get('progress_bar_kw', {})):
+
+        distances, predecessors, _, _ = _dijkstra_tree(
+            indptr, indices, weights, index[origin], terminal,
+            )
+
+        reached = [nodes[idx] for idx in np.flatnonzero(np.isfinite(distances))]
+
+        costs = {}
+        values = {}
+        paths = {}
+
+        infeasible = []
+
+        for destination in np.intersect1d(reached, destinations):
+
+            path = recover_path(
+                nodes, predecessors, index[origin], index[destination]
+                )
+
+            cost, path_values, path_feasible = replay_path(
+                graph, objective, path, infinity
+                )
+
+            if not path_feasible:
+
+                infeasible.append(destination)
+
+                continue
+
+            costs[destination] = cost
+            values[destination] = path_values
+
+            if return_paths:
+
+                paths[destination] = path
+
+        if infeasible:
+
+            route_infeasible(
+                graph, objective, origin, infeasible, costs, values, paths,
+                destinations = destinations if terminate_at_destinations else [],
+                neighbors = kwargs.get('neighbors', None),
+                return_paths = return_paths,
+                )
+
+        yield origin, costs, values, paths if return_paths else None
+
+def replay_path(graph, objective, path, infinity = None):
+    '''
+    Replays a path through the objective to produce its cost, values, and feasibility
+    '''
+
+    infinity = objective.infinity() if infinity is None else infinity
+
+    values = objective.initial()
+    path_feasible = True
+
+    for idx in range(len(path) - 1):
+
+        values, feasible = objective.update(
+            values, graph._adj[path[idx]][path[idx + 1]],
+            )
+
+        path_feasible *= feasible
+
+    if len(path) == 1:
+
+        cost = 0
+
+    else:
+
+        cost, _ = objective.compare(values, infinity)
+
+    return cost, values, path_feasible
+
+def route_infeasible(
+    graph, objective, origin, infeasible, costs, values, paths, **kwargs
+    ):
+    '''
+    Reroutes from origin to the destinations in infeasible with the objective-driven
+    dijkstra and adds those reached feasibly to costs, values, and paths in place
+
+    Used for destinations whose path on scalar edge costs fails the objective on
+    replay. kwargs destinations (routes may not pass through them), neighbors, and
+    return_paths are as in iter_johnson.
+    '''
+
+    return_paths = kwargs.get('return_paths', True)
+
+    origin_costs, origin_values, origin_paths = dijkstra(
+        graph, [origin],
+        objective = objective,
+        destinations = kwargs.get('destinations', []),
+        neighbors = kwargs.get('neighbors', None),
+        )
+
+    for destination in infeasible:
+
+        if destination not in origin_costs:
+
+            continue
+
+        costs[destination] = origin_costs[destination]
+        values[destination] = origin_values[destination]
+
+        if return_paths:
+
+            paths[destination] = origin_paths[destination]
+
+def recover_path(nodes, predecessors, origin, destination):
+    '''
+    Recovers a path of node ids by working backward from destination to origin
+    '''
+
+    path = [nodes[destination]]
+
+    while destination != origin:
+
+        destination = predecessors[destination]
+        path.append(nodes[destination])
+
+    return path[::-1]
+
+@jit(nopython = True, cache = True)
+def _dijkstra_tree(indptr, indices, weights, origin, terminal):
+    '''
+    Single-origin Dijkstra over CSR arrays returning the shortest path tree
+
+    Returns distances, predecessors, the tree edge into each node, and the nodes in
+    the order settled. Nodes flagged as terminal (other than the origin) are reached
+    but not expanded.
+    '''
+
+    n = len(indptr) - 1
+
+    distances = np.full(n, np.inf)
+    predecessors = -np.ones(n, dtype = np.int64)
+    edges = -np.ones(n, dtype = np.int64)
+    order = -np.ones(n, dtype = np.int64)
+    settled = np.zeros(n, dtype = np.bool_)
+
+    distances[origin] = 0.
+    predecessors[origin] = origin
+
+    heap = [(0., origin)]
+
+    count = 0
+
+    while heap:
+
+        distance, source = heapq.heappop(heap)
+
+        if settled[source]:
+
+            continue
+
+        settled[source] = True
+
+        order[count] = source
+        count += 1
+
+        if terminal[source] and (source != origin):
+
+            continue
+
+        for idx in range(indptr[source], indptr[source + 1]):
+
+            target = indices[idx]
+            distance_target = distance + weights[idx]
+
+            if distance_target < distances[target]:
+
+                distances[target] = distance_target
+                predecessors[target] = source
+                edges[target] = idx
+
+                heapq.heappush(heap, (distance_target, target))
+
+    return distances, predecessors, edges, order[:count]
+
+@jit(nopython = True, cache = True)
+def _bellman_ford_csr(indptr, indices, weights):
+    '''
+    Bellman-Ford from a virtual node connected to every node at zero cost
+
+    Returns node potentials for Johnson reweighting and a negative cycle flag
+    '''
+
+    n = len(indptr) - 1
+
+    potentials = np.zeros(n)
+
+    for iteration in range(n + 1):
+
+        changed = False
+
+        for source in range(n):
+            for idx in range(indptr[source], indptr[source + 1]):
+
+                target = indices[idx]
+
+                if potentials[source] + weights[idx] < potentials[target]:
+
+                    potentials[target] = potentials[source] + weights[idx]
+                    changed = True
+
+        if not changed:
+
+            return potentials, False
+
+    return potentials, True
@@ -0,0 +1,440 @@
+'''
+Module for routing several vehicles (lanes) in one search
+
+Vehicles which differ only in parameters such as capacity, power, and risk attitude
+often share optimal trees. Per-vehicle edge costs are stacked into an (lanes, edges)
+array and, for each origin, a compiled Dijkstra is run for one reference lane. The
+resulting tree is accumulated under every lane's edge costs and checked for optimality
+with the Bellman conditions (no edge improves a tree distance) in one pass over the
+edges. Lanes for which the tree is optimal are settled together and the search is
+repeated for the remaining lanes only.
+
+Lane costs must be additive scalars as for the johnson engine (see johnson.py). Lanes
+may be vehicles with cases = 1 (lane_all_pairs_shortest_paths) or the cases of one
+multi-case vehicle under Case expectations (case_all_pairs_shortest_paths).
+'''
+import numpy as np
+
+from numba import jit
+
+from .progress_bar import ProgressBar
+from .routing import Label, edge_cost_table
+from .overlay import Overlay
+from .johnson import _dijkstra_tree
+
+# Label fields accumulated by Vehicle.update and the edge fields they accumulate
+_label_fields = {
+    'total_time': 'total_time',
+    'routing_time': 'routing_time',
+    'driving_time': 'time',
+    'charging_time': 'charging_time',
+    'distance': 'distance',
+    'price': 'price',
+}
+
+def csr_from_adjacency(graph):
+    '''
+    Returns the nodes, node index, and CSR indptr and indices of the edges of a graph
+    or Overlay. CSR positions follow the iteration order of the adjacency (the edge
+    indices of an Overlay).
+    '''
+
+    nodes = list(graph._adj.keys())
+    index = {node: idx for idx, node in enumerate(nodes)}
+
+    indptr = np.zeros(len(nodes) + 1, dtype = np.int64)
+    indices = []
+
+    for source, adj in graph._adj.items():
+
+        indptr[index[source] + 1] = len(adj)
+
+        indices.extend(index[target] for target in adj.keys())
+
+    indptr = np.cumsum(indptr)
+    indices = np.array(indices, dtype = np.int64)
+
+    return nodes, index, indptr, indices
+
+def fleet_edge_costs(overlay, vehicles, common_random_numbers = True):
+    '''
+    Computes the edge costs of each vehicle on an Overlay in bulk with edge_cost_table
+
+    If common_random_numbers is True the station generators are reset before costing
+    each vehicle so that all vehicles see the same station delay draws (vehicles with
+    the same risk attitude see identical delays). Otherwise each vehicle draws anew
+    as when vehicles are costed one after another.
+
+    Returns a dictionary of (vehicles, edges) arrays for the routing cost (infinite
+    where infeasible) and for each edge field accumulated into the labels. The Overlay
+    itself is not re-costed.
+    '''
+
+    stations = [
+        node['station'] for node in overlay.node_attributes.values()
+        if node['station'] is not None
+        ]
+
+    states = [station.rng.bit_generator.state for station in stations]
+
+    # Fields not costed at stations are taken from the base edges for all lanes
+    base = {}
+
+    for field in set(_label_fields.values()) | {v.cost for v in vehicles}:
+
+        base[field] = np.array(
+            [edge.get(field, np.inf) for edge in overlay.edges], dtype = float
+            )
+
+    fields = {field: [] for field in base.keys()}
+    weights = []
+
+    for vehicle in vehicles:
+
+        if vehicle.cases > 1:
+
+            raise ValueError('lanes require scalar vehicles (cases = 1)')
+
+        if common_random_numbers:
+
+            for station, state in zip(stations, states):
+
+                station.rng.bit_generator.state = state
+
+        table = edge_cost_table(overlay, vehicle)
+
+        idx = np.array(
+            [overlay.index[s][t] for s, t in zip(table['sources'], table['targets'])],
+            dtype = np.int64,
+            )
+
+        feasible = np.ones(len(overlay.edges), dtype = bool)
+        feasible[idx] = table['feasible']
+
+        for field in fields.keys():
+
+            column = base[field].copy()
+
+            if field in table:
+
+                column[idx] = table[field]
+
+            fields[field].append(column)
+
+        weights.append(np.where(feasible, fields[vehicle.cost][-1], np.inf))
+
+    table = {field: np.array(column) for field, column in fields.items()}
+    table['weights'] = np.array(weights)
+
+    return table
+
+def lane_shortest_paths(indptr, indices, weights, origin, terminal):
+    '''
+    Single-origin shortest paths for every lane of an (lanes, edges) weights array
+
+    Returns (lanes, nodes) distances, the predecessor and tree edge arrays of each
+    tree searched, the tree index of each lane, and the number of searches run
+    '''
+
+    lanes = weights.shape[0]
+
+    distances = np.full((lanes, len(indptr) - 1), np.inf)
+    assignment = -np.ones(lanes, dtype = np.int64)
+
+    trees = []
+
+    unresolved = np.arange(lanes)
+
+    while unresolved.size > 0:
+
+        reference = unresolved[0]
+
+        _, predecessors, edges, order = _dijkstra_tree(
+            indptr, indices, weights[reference], origin, terminal,
+            )
+
+        lane_weights = weights[unresolved]
+
+        lane_distances = _tree_distances(
+            order, predecessors, edges, lane_weights, origin,
+            )
+
+        optimal = _tree_optimal(
+            indptr, indices, lane_weights, lane_distances, terminal, origin,
+            )
+
+        optimal[0] = True
+
+        distances[unresolved[optimal]] = lane_distances[optimal]
+        assignment[unresolved[optimal]] = len(trees)
+
+        trees.append((predecessors, edges))
+
+        unresolved = unresolved[~optimal]
+
+    return distances, trees, assignment, len(trees)
+
+def lane_all_pairs_shortest_paths(graph, origins, vehicles, **kwargs):
+    '''
+    All-pairs routing between origins for several vehicles in one search per origin
+
+    args:
+
+    graph - Overlay or base graph. If a base graph is given an Overlay is built with
+    station_kw
+    origins - list of nodes between which routes are computed
+    vehicles - list of Vehicle objects with cases = 1
+
+    kwargs:
+
+    station_kw - Station kwargs keyed by node type (required if graph is not an Overlay)
+    common_random_numbers - see fleet_edge_costs
+    return_paths - if False paths are not returned
+    progress_bar_kw - kwargs for the progress bar
+
+    Returns a list with one (costs, values, paths) tuple per vehicle in the format of
+    routing.all_pairs_shortest_paths and a dictionary with the number of lanes and of
+    searches run
+    '''
+
+    if isinstance(graph, Overlay):
+
+        overlay = graph
+
+    else:
+
+        overlay = Overlay(graph, kwargs['station_kw'])
+
+    table = fleet_edge_costs(
+        overlay, vehicles, kwargs.get('common_random_numbers', True),
+        )
+
+    def label(lane, path_edges):
+
+        values = Label()
+
+        for key, field in _label_fields.items():
+
+            values[key] = vehicles[lane].initial_values[key] + np.cumsum(
+                np.append(0., table[field][lane, path_edges])
+                )[-1]
+
+        return values
+
+    return _route_lanes(overlay, origins, table['weights'], label, kwargs)
+
+def case_edge_costs(graph, vehicle):
+    '''
+    Reads the per-case edge costs of a costed graph or Overlay
+
+    Returns a dictionary of (edges, cases) arrays for each edge field accumulated into
+    the labels and the (cases, edges) routing costs (infinite where infeasible) in the
+    iteration order of the adjacency
+    '''
+
+    edges = [edge for adj in graph._adj.values() for edge in adj.values()]
+
+    shape = (len(edges), vehicle.cases)
+
+    table = {}
+
+    for field in set(_label_fields.values()) | {vehicle.cost}:
+
+        column = np.empty(shape)
+
+        for idx, edge in enumerate(edges):
+
+            column[idx] = edge.get(field, np.inf)
+
+        table[field] = column
+
+    feasible = np.array([edge.get('feasible', True) for edge in edges], dtype = bool)
+
+    table['weights'] = np.where(feasible[:, None], table[vehicle.cost], np.inf).T
+
+    return table
+
+def case_all_pairs_shortest_paths(graph, origins, vehicle, **kwargs):
+    '''
+    All-pairs routing between origins for every case of a multi-case vehicle
+
+    Each case is a lane whose cost is that case's entry of the cost field, equivalent to
+    routing with vehicle.select_case(case). All cases are routed together (see
+    lane_shortest_paths) rather than in one search per case.
+
+    args:
+
+    graph - graph or Overlay costed for vehicle (see supply_costs)
+    origins - list of nodes between which routes are computed
+    vehicle - Vehicle with cases >= 1
+
+    kwargs:
+
+    return_paths - if False paths are not returned
+    progress_bar_kw - kwargs for the progress bar
+
+    Returns a list with one (costs, values, paths) tuple per case in the format of
+    routing.all_pairs_shortest_paths (values hold all cases of the route chosen for the
+    case) and a dictionary with the number of lanes and of searches run
+    '''
+
+    table = case_edge_costs(graph, vehicle)
+
+    def label(lane, path_edges):
+
+        values = Label()
+
+        for key, field in _label_fields.items():
+
+            values[key] = vehicle.initial_values[key] + np.cumsum(
+                np.vstack((np.zeros(vehicle.cases), table[field][path_edges])), axis = 0
+                )[-1]
+
+        return values
+
+    return _route_lanes(graph, origins, table['weights'], label, kwargs)
+
+def _route_lanes(graph, origins, weights, label, kwargs):
+    '''
+    Routes every lane of a (lanes, edges) weights array between origins. label is a
+    function of the lane and the path edge indices returning the path values.
+    '''
+
+    return_paths = kwargs.get('return_paths', True)
+
+    nodes, index, indptr, indices = csr_from_adjacency(graph)
+
+    terminal = np.zeros(len(nodes), dtype = np.bool_)
+    terminal[[index[o] for o in origins]] = True
+
+    lanes = weights.shape[0]
+
+    results = [({}, {}, {}) for lane in range(lanes)]
+
+    info = {'lanes': 0, 'searches': 0}
+
+    for origin in ProgressBar(origins, **kwargs.get('progress_bar_kw', {})):
+
+        distances, trees, assignment, searches = lane_shortest_paths(
+            indptr, indices, weights, index[origin], terminal,
+            )
+
+        info['lanes'] += lanes
+        info['searches'] += searches
+
+        for lane in range(lanes):
+
+            costs, values, paths = results[lane]
+
+            costs[origin] = {}
+            values[origin] = {}
+            paths[origin] = {}
+
+            predecessors, edges = trees[assignment[lane]]
+
+            reached = [
+                nodes[idx] for idx in np.flatnonzero(np.isfinite(distances[lane]))
+                ]
+
+            for destination in np.intersect1d(reached, origins):
+
+                path, path_edges = _tree_path(
+                    predecessors, edges, index[origin], index[destination],
+                    )
+
+                costs[origin][destination] = distances[lane, index[destination]]
+                values[origin][destination] = label(lane, path_edges)
+
+                if return_paths:
+
+                    paths[origin][destination] = [nodes[idx] for idx in path]
+
+    if not return_paths:
+
+        results = [(costs, values, None) for costs, values, paths in results]
+
+    return results, info
+
+def _tree_path(predecessors, edges, origin, destination):
+    '''
+    Recovers the node indices and edge indices of a tree path
+    '''
+
+    path = [destination]
+    path_edges = []
+
+    while destination != origin:
+
+        path_edges.append(edges[destination])
+
+        destination = predecessors[destination]
+
+        path.append(destination)
+
+    return path[::-1], np.array(path_edges[::-1], dtype = np.int64)
+
+@jit(nopython = True, cache = True)
+def _tree_distances(order, predecessors, edges, weights, origin):
+    '''
+    Accumulates the (lanes, edges) weights along a tree in settled order
+    '''
+
+    lanes = weights.shape[0]
+
+    distances = np.full((lanes, len(predecessors)), np.inf)
+
+    for lane in range(lanes):
+
+        distances[lane, origin] = 0.
+
+    for node in order:
+
+        if node == origin:
+
+            continue
+
+        for lane in range(lanes):
+
+            distances[lane, node] = (
+                distances[lane, predecessors[node]] + weights[lane, edges[node]]
+                )
+
+    return distances
+
+@jit(nopython = True, cache = True)
+def _tree_optimal(indptr, indices, weights, distances, terminal, origin):
+    '''
+    Checks the Bellman conditions of tree distances for each lane
+    '''
+
+    lanes = weights.shape[0]
+    n = len(indptr) - 1
+
+    optimal = np.ones(lanes, dtype = np.bool_)
+
+    for lane in range(lanes):
+        for source in range(n):
+
+            if not optimal[lane]:
+
+                break
+
+            distance = distances[lane, source]
+
+            if distance == np.inf:
+
+                continue
+
+            if terminal[source] and (source != origin):
+
+                continue
+
+            for idx in range(indptr[source], indptr[source + 1]):
+
+                if distance + weights[lane, idx] < distances[lane, indices[idx]]:
+
+                    optimal[lane] = False
+
+                    break
+
+    return optimal
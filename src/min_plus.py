@@ -0,0 +1,224 @@
+'''
+Module for min-plus (tropical) matrix product routing
+
+Place-to-place routing on an SNG only uses stations as intermediaries. Rather than
+running Floyd-Warshall over all n nodes, the station-to-station closure is computed
+once and place-to-place results are obtained by two min-plus products:
+
+place -> station (x) station closure (x) station -> place
+
+Station closures are cached by the contents of the station adjacency so that vehicles
+(or scenarios) which share station-to-station edge costs reuse the same closure.
+'''
+import hashlib
+
+import numpy as np
+import networkx as nx
+
+from .floyd_warshall import _floyd_warshall_fields, recover_path
+
+_closure_cache = {}
+
+def clear_cache():
+    '''
+    Empties the station closure cache
+    '''
+
+    _closure_cache.clear()
+
+def min_plus(graph, fields, places, **kwargs):
+    '''
+    Place-to-place all-pairs routing via min-plus products over a station closure
+
+    args:
+
+    graph is a NetworkX Graph
+    fields is a list of edge attributes - the first one listed will be used for routing
+    places is a list of node indices between which routes will be computed
+
+    kwargs:
+
+    stations - list of node indices which can serve as intermediaries in routes. If not
+    provided all non-place nodes will be used
+    block_size - number of rows processed per vectorized min-plus block
+    cache - if True station closures are reused between calls
+    max_cache_size - maximum number of cached station closures
+    return_paths - if False paths are not recovered
+
+    returns costs (places, places), values (places, places, fields), and paths as a
+    dictionary of dictionaries keyed by node index. Routes are equivalent to those
+    produced by floyd_warshall with pivots = stations.
+    '''
+
+    # Creating adjacency tensor
+    adjacency = np.stack(
+        [nx.to_numpy_array(graph, weight = f) for f in fields], axis = -1
+        )
+
+    return min_plus_adjacency(adjacency, places, **kwargs)
+
+def min_plus_adjacency(adjacency, places, **kwargs):
+    '''
+    Place-to-place all-pairs routing via min-plus products on an (n, n, n_fields)
+    adjacency array where the first field is used for routing. Non-edges should be set
+    to infinite cost. See min_plus for kwargs and returns.
+    '''
+
+    block_size = kwargs.get('block_size', 64)
+    cache = kwargs.get('cache', True)
+    max_cache_size = kwargs.get('max_cache_size', 16)
+    return_paths = kwargs.get('return_paths', True)
+
+    n = len(adjacency)
+
+    places = np.atleast_1d(places).astype(int)
+
+    stations = kwargs.get(
+        'stations', np.setdiff1d(np.arange(n), places)
+        )
+
+    stations = np.atleast_1d(stations).astype(int)
+
+    place_station = adjacency[places][:, stations]
+    station_place = adjacency[stations][:, places]
+    direct = adjacency[places][:, places]
+
+    closure, closure_predecessors = station_closure(
+        adjacency[stations][:, stations],
+        cache = cache,
+        max_cache_size = max_cache_size,
+        )
+
+    # place -> station closure
+    to_station, first = min_plus_product(place_station, closure, block_size)
+
+    # place -> station closure -> place
+    via_station, last = min_plus_product(to_station, station_place, block_size)
+
+    # Direct place -> place edges are used unless improved upon via stations
+    use_direct = ~(via_station[:, :, 0] < direct[:, :, 0])
+
+    values = np.where(use_direct[:, :, None], direct, via_station)
+    costs = values[:, :, 0]
+
+    paths = None
+
+    if return_paths:
+
+        paths = {}
+
+        for idx_o, origin in enumerate(places):
+
+            paths[origin] = {}
+
+            for idx_d, destination in enumerate(places):
+
+                if origin == destination:
+
+                    path = [origin]
+
+                elif use_direct[idx_o, idx_d] or (last[idx_o, idx_d] < 0):
+
+                    path = [origin, destination]
+
+                else:
+
+                    target = last[idx_o, idx_d]
+                    source = first[idx_o, target]
+
+                    path = (
+                        [origin] +
+                        [stations[s] for s in recover_path(
+                            closure_predecessors, source, target
+                            )] +
+                        [destination]
+                        )
+
+                paths[origin][destination] = [int(node) for node in path]
+
+    return costs, values, paths
+
+def station_closure(adjacency, cache = True, max_cache_size = 16):
+    '''
+    Computes the all-pairs closure of an (s, s, n_fields) station adjacency
+
+    The diagonal is set to zero so that the closure is an identity-containing operand
+    for min-plus products (a route may pass through a single station)
+    '''
+
+    key = None
+
+    if cache:
+
+        key = (
+            adjacency.shape,
+            hashlib.sha1(np.ascontiguousarray(adjacency).tobytes()).hexdigest(),
+            )
+
+        if key in _closure_cache:
+
+            return _closure_cache[key]
+
+    s = len(adjacency)
+
+    values = np.zeros_like(adjacency)
+    predecessors = np.zeros((s, s), dtype = int)
+
+    values, predecessors = _floyd_warshall_fields(
+        adjacency, np.arange(s), values, predecessors,
+        )
+
+    values[np.arange(s), np.arange(s)] = 0
+    predecessors[np.arange(s), np.arange(s)] = np.arange(s)
+
+    if cache:
+
+        while len(_closure_cache) >= max_cache_size:
+
+            _closure_cache.pop(next(iter(_closure_cache)))
+
+        _closure_cache[key] = (values, predecessors)
+
+    return values, predecessors
+
+def min_plus_product(left, right, block_size = 64):
+    '''
+    Blocked, vectorized min-plus product of (m, k, n_fields) and (k, r, n_fields) arrays
+
+    The product is taken on the first field and the remaining fields are carried from
+    the minimizing intermediary. Returns an (m, r, n_fields) array and the (m, r)
+    indices of the minimizing intermediaries (-1 where no finite route exists).
+    '''
+
+    m, k, n_fields = left.shape
+    r = right.shape[1]
+
+    values = np.full((m, r, n_fields), np.inf)
+    intermediaries = -np.ones((m, r), dtype = int)
+
+    if (k == 0) or (m == 0) or (r == 0):
+
+        return values, intermediaries
+
+    columns = np.arange(r)
+
+    for start in range(0, m, block_size):
+
+        stop = min([start + block_size, m])
+
+        # (block, k, r) sums on the primary field
+        sums = left[start:stop, :, None, 0] + right[None, :, :, 0]
+
+        minimizer = np.argmin(sums, axis = 1)
+
+        rows = np.arange(stop - start)[:, None]
+
+        values[start:stop] = (
+            left[start:stop][rows, minimizer] + right[minimizer, columns[None, :]]
+            )
+
+        intermediaries[start:stop] = np.where(
+            np.isfinite(values[start:stop, :, 0]), minimizer, -1
+            )
+
+    return values, intermediaries
@@ -0,0 +1,333 @@
+'''
+Module for copy-free scenario overlays on a shared SNG
+
+supply_costs writes stations and resupply costs into the node and edge dictionaries of
+the graph so evaluating several vehicles or station configurations at once requires a
+deep copy of the graph per scenario. An Overlay instead keeps the scenario-specific
+attributes (edge types, stations, and cost fields) in columns indexed by edge index on
+top of an unmodified base graph.
+
+An Overlay exposes _node and _adj dictionaries of read-only views so that dijkstra,
+bellman, johnson, and the dense engines route on it as they would on the graph. Edge
+views read the overlay columns directly at their edge index so costing a scenario does
+not copy any per-edge data into the views.
+
+The edges of an undirected NetworkX graph hold one dictionary shared by both
+directions so supply_costs writes the attributes of both directions into it and the
+last write wins. An Overlay gives both directions one edge index so that it produces
+the same attributes.
+'''
+import numpy as np
+
+from collections.abc import Mapping
+
+from .routing import Station, StationTable, edge_cost_table
+
+_cost_fields = (
+    'feasible', 'energy', 'charging_time', 'delay_time', 'total_time', 'routing_time',
+    )
+
+class Overlay():
+    '''
+    Scenario-specific view of a base graph
+
+    args:
+
+    graph - base NetworkX graph which is not modified. Directions which share an edge
+    dictionary (undirected graphs) share an edge index.
+    station_kw - dictionary of Station kwargs keyed by node type or a StationTable
+    (see supply_costs)
+    vehicle - if provided the edges are costed for vehicle on construction
+    '''
+
+    def __init__(self, graph, station_kw = {}, vehicle = None):
+
+        self.graph = graph
+
+        self.edges = []
+        self.index = {}
+
+        # Edge index of each edge dictionary
+        shared = {}
+
+        # Attributes defined for every edge, written in the order of edge_types
+        types = []
+
+        for source, adj in graph._adj.items():
+
+            self.index[source] = {}
+
+            for target, edge in adj.items():
+
+                idx = shared.get(id(edge), None)
+
+                if idx is None:
+
+                    idx = len(self.edges)
+
+                    shared[id(edge)] = idx
+
+                    self.edges.append(edge)
+                    types.append(None)
+
+                self.index[source][target] = idx
+
+                types[idx] = f"to_{graph._node[target].get('type', 'none')}"
+
+        self.columns = {'type': types}
+
+        # Cost fields defined for the edges out of stations. One-dimensional fields
+        # are held as lists which the edge views index faster than arrays.
+        self.costs = {}
+        self.costed = [False] * len(self.edges)
+
+        self.node_attributes = {k: {'station': None} for k in graph._node.keys()}
+
+        self._node = {
+            k: _NodeView(self.node_attributes[k], v) for k, v in graph._node.items()
+            }
+
+        self._adj = {}
+
+        for source, adj in graph._adj.items():
+
+            self._adj[source] = {}
+
+            for target, edge in adj.items():
+
+                self._adj[source][target] = _EdgeView(
+                    self, self.index[source][target], edge
+                    )
+
+        self.vehicle = None
+
+        if station_kw:
+
+            self.add_stations(station_kw)
+
+        if vehicle is not None:
+
+            self.cost(vehicle)
+
+    @property
+    def nodes(self):
+
+        return self.graph.nodes
+
+    def number_of_nodes(self):
+
+        return self.graph.number_of_nodes()
+
+    def add_stations(self, station_kw):
+        '''
+        Builds a Station at each node with a type in station_kw. station_kw may also be
+        a StationTable whose views are used as the stations.
+        '''
+
+        if isinstance(station_kw, StationTable):
+
+            stations = station_kw.stations()
+
+            for source in self.graph._node.keys():
+
+                self.node_attributes[source]['station'] = stations.get(source, None)
+
+            return self
+
+        for source, node in self.graph._node.items():
+
+            if node['type'] in station_kw:
+
+                self.node_attributes[source]['station'] = Station(
+                    node, **station_kw[node['type']]
+                    )
+
+            else:
+
+                self.node_attributes[source]['station'] = None
+
+        return self
+
+    def cost(self, vehicle):
+        '''
+        Computes resupply costs for vehicle on the out-edges of each station and stores
+        them in columns indexed by edge index. Results are identical to supply_costs.
+        Where both directions of a shared edge are costed the later one is kept as in
+        supply_costs.
+        '''
+
+        table = edge_cost_table(self, vehicle)
+
+        idx = np.array(
+            [self.index[s][t] for s, t in zip(table['sources'], table['targets'])],
+            dtype = int,
+            )
+
+        # Keeping the last row written to each edge index
+        _, last = np.unique(idx[::-1], return_index = True)
+        rows = np.sort(len(idx) - 1 - last)
+
+        idx = idx[rows]
+
+        costed = np.zeros(len(self.edges), dtype = bool)
+        costed[idx] = True
+
+        # Updated in place as the edge views hold references to costed and costs
+        self.costed[:] = costed.tolist()
+
+        self.costs.clear()
+
+        for field in _cost_fields:
+
+            column = table[field]
+
+            if isinstance(column, list):
+
+                array = np.empty(len(self.edges), dtype = object)
+                array[idx] = [column[row] for row in rows]
+
+            else:
+
+                column = np.asarray(column)[rows]
+
+                array = np.zeros((len(self.edges), *column.shape[1:]), column.dtype)
+                array[idx] = column
+
+                if array.ndim == 1:
+
+                    array = array.tolist()
+
+            self.costs[field] = array
+
+        self.vehicle = vehicle
+
+        return self
+
+    def edge(self, source, target):
+        '''
+        Returns a dictionary of the base and overlay attributes of an edge
+        '''
+
+        return dict(self._adj[source][target])
+
+class _NodeView(Mapping):
+    '''
+    Read-only view of a base node with overlay attributes taking precedence
+    '''
+
+    __slots__ = ('attributes', 'node')
+
+    def __init__(self, attributes, node):
+
+        self.attributes = attributes
+        self.node = node
+
+    def __getitem__(self, key):
+
+        if key in self.attributes:
+
+            return self.attributes[key]
+
+        return self.node[key]
+
+    def get(self, key, default = None):
+
+        if key in self.attributes:
+
+            return self.attributes[key]
+
+        return self.node.get(key, default)
+
+    def __iter__(self):
+
+        yield from self.attributes
+
+        yield from (k for k in self.node if k not in self.attributes)
+
+    def __len__(self):
+
+        return len(set(self.attributes) | set(self.node))
+
+class _EdgeView(Mapping):
+    '''
+    Read-only view of a base edge with overlay attributes taking precedence
+
+    Overlay attributes are read from the overlay columns and costs at the edge index of
+    the view
+    '''
+
+    __slots__ = ('columns', 'costs', 'costed', 'idx', 'edge')
+
+    def __init__(self, overlay, idx, edge):
+
+        self.columns = overlay.columns
+        self.costs = overlay.costs
+        self.costed = overlay.costed
+        self.idx = idx
+        self.edge = edge
+
+    def _keys(self):
+
+        if self.costed[self.idx]:
+
+            return list(self.columns) + list(self.costs)
+
+        return list(self.columns)
+
+    def __getitem__(self, key):
+
+        idx = self.idx
+
+        if self.costed[idx]:
+
+            column = self.costs.get(key, None)
+
+            if column is not None:
+
+                return column[idx]
+
+        column = self.columns.get(key, None)
+
+        if column is not None:
+
+            return column[idx]
+
+        return self.edge[key]
+
+    def get(self, key, default = None):
+
+        idx = self.idx
+
+        if self.costed[idx]:
+
+            column = self.costs.get(key, None)
+
+            if column is not None:
+
+                return column[idx]
+
+        column = self.columns.get(key, None)
+
+        if column is not None:
+
+            return column[idx]
+
+        return self.edge.get(key, default)
+
+    def __contains__(self, key):
+
+        return (key in self.columns) or (key in self.edge) or (
+            self.costed[self.idx] and (key in self.costs)
+            )
+
+    def __iter__(self):
+
+        keys = self._keys()
+
+        yield from keys
+
+        yield from (k for k in self.edge if k not in keys)
+
+    def __len__(self):
+
+        return len(set(self._keys()) | set(self.edge))
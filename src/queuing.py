@@ -1,6 +1,8 @@
 import time
 import numpy as np
 
+from collections import OrderedDict
+from collections.abc import Hashable
 from heapq import heappop, heappush
 from itertools import count
 from scipy.stats import rv_histogram, norm
@@ -183,15 +185,208 @@ class System():
 
         return queue, served, status
 
+    def simulate_events(self, steps = 1000, step = 1, times = None):
+        '''
+        Event-driven equivalent of simulate
+
+        Arrivals and service completions are processed from a heap of events rather
+        than by advancing every customer and server at each step. Status is sampled at
+        times (defaults to the end of each step of simulate) and the system is
+        simulated until time steps. Returns queue, served, and status as simulate.
+        '''
+
+        if times is None:
+
+            times = np.arange(0, steps, step) + step
+
+        times = np.sort(np.atleast_1d(times))
+
+        counter = count()
+        events = count()
+
+        queue = []
+        served = []
+
+        arrivals = {}
+
+        status = {
+            'in_queue': [],
+            'in_service': [],
+            'in_served': [],
+        }
+
+        for customer in self.demand.initial_customers:
+
+            arrivals[id(customer)] = 0
+
+            heappush(queue, (next(counter), customer))
+
+        heap = [] # heap of (time, count, server index or None for arrivals)
+
+        heappush(heap, (self.demand.interval, next(events), None))
+
+        in_service = 0
+
+        # System state after each event, starting with the initial state
+        history = {
+            'time': [-np.inf],
+            'in_queue': [],
+            'in_service': [],
+            'in_served': [],
+        }
+
+        def dispatch(now):
+
+            nonlocal in_service
+
+            for idx, server in enumerate(self.servers):
+
+                if (server.status == 'vacant') and queue:
+
+                    _, customer = heappop(queue)
+
+                    server.start(customer)
+
+                    duration = (
+                        (customer.capacity - customer.level) / server.service_rate
+                        )
+
+                    customer.steps_service = duration
+
+                    heappush(heap, (now + duration, next(events), idx))
+
+                    in_service += 1
+
+            history['in_queue'].append(len(queue))
+            history['in_service'].append(in_service)
+            history['in_served'].append(len(served))
+
+        dispatch(0)
+
+        while heap[0][0] <= steps:
+
+            now, _, idx = heappop(heap)
+
+            if idx is None: # Arrival
+
+                customer = Customer(capacity = self.demand.capacity(self.demand.rng))
+
+                if len(queue) <= self.demand.max_length - 1:
+
+                    arrivals[id(customer)] = now
+
+                    heappush(queue, (next(counter), customer))
+
+                interval = self.demand.inter_arrival(self.demand.rng)
+
+                heappush(heap, (now + interval, next(events), None))
+
+            else: # Service completion
+
+                customer = self.servers[idx].finish()
+
+                customer.level = customer.capacity
+                customer.status = 'complete'
+                customer.steps = now - arrivals.pop(id(customer))
+
+                served.append(customer)
+
+                in_service -= 1
+
+            history['time'].append(now)
+
+            dispatch(now)
+
+        # Sampling the state after the last event at or before each requested time
+        index = np.searchsorted(history['time'], times, side = 'right') - 1
+
+        for key in status.keys():
+
+            status[key] = list(np.array(history[key])[index])
+
+        for _, customer in queue:
+
+            customer.steps = steps - arrivals[id(customer)]
+
+        return queue, served, status
+
+def simulate_replications(servicers = 1, replications = 1000, customers = 1000, **kwargs):
+    '''
+    Simulates independent M/G/c queue replications in lockstep with arrays
+
+    Customers are served first-come-first-served by the earliest free servicer. Each
+    step of the loop assigns the next customer in every replication at once so the
+    Python loop runs over customers rather than replications, customers, and time.
+
+    kwargs:
+
+    seed - seed for a SeedSequence from which the single random stream is drawn
+    inter_arrival - function (rng, size) -> array of inter-arrival times
+    service_time - function (rng, size) -> array of service durations
+    initial - number of customers waiting at time zero
+
+    Returns a (replications, customers) array of waiting times
+    '''
+
+    seed = kwargs.get('seed', None)
+    inter_arrival = kwargs.get(
+        'inter_arrival', lambda rng, size: rng.exponential(1, size)
+        )
+    service_time = kwargs.get('service_time', lambda rng, size: np.ones(size))
+    initial = min([kwargs.get('initial', 0), customers])
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+
+    arrival_time = np.zeros((replications, customers))
+    arrival_time[:, initial:] = np.cumsum(
+        inter_arrival(rng, (replications, customers - initial)), axis = 1
+        )
+
+    service_duration = service_time(rng, (replications, customers))
+
+    free_time = np.zeros((replications, servicers))
+
+    waiting_time = np.zeros((replications, customers))
+
+    rows = np.arange(replications)
+
+    for idx in range(customers):
+
+        servicer = np.argmin(free_time, axis = 1)
+
+        start_time = np.maximum(arrival_time[:, idx], free_time[rows, servicer])
+
+        waiting_time[:, idx] = start_time - arrival_time[:, idx]
+
+        free_time[rows, servicer] = start_time + service_duration[:, idx]
+
+    return waiting_time
+
 def simulated_queuing_time_distribution(**kwargs):
 
+    if kwargs.get('method', 'step') == 'replications':
+
+        waiting_time = simulate_replications(
+            kwargs.get('n', 1), **kwargs.get('replications', {})
+            )
+
+        return rv_histogram(
+            np.histogram(waiting_time.ravel(), **kwargs.get('histogram', {}))
+            )
+
     servers = [Server(**kwargs.get('server', {})) for idx in range(kwargs.get('n', 1))]
 
     demand = Demand(**kwargs.get('demand', {}))
 
     system = System(servers, demand)
 
-    _, served, _ = system.simulate(**kwargs.get('simulation', {}))
+    if kwargs.get('method', 'step') == 'event':
+
+        _, served, _ = system.simulate_events(**kwargs.get('simulation', {}))
+
+    else:
+
+        _, served, _ = system.simulate(**kwargs.get('simulation', {}))
 
     queue_steps = np.array([customer.steps - customer.steps_service for customer in served])
 
@@ -220,6 +415,92 @@ def mmc_queue(arrival_rate, service_rate, servicers, max_time = np.inf):
 
     return min([np.nanmax([waiting_time, 0]), max_time])
 
+def erlang_c_waiting_time(arrival_rate, service_rate, servicers, max_time = np.inf):
+    '''
+    Vectorized M/M/c expected waiting time (Erlang C)
+
+    Arguments are broadcast against each other. The Erlang B blocking probability is
+    built with the stable recurrence B(k) = a B(k - 1) / (k + a B(k - 1)) where a is the
+    offered load, avoiding the factorials and powers used in mmc_queue which overflow
+    for large numbers of servicers. Unstable queues (rho >= 1) wait indefinitely.
+    '''
+
+    arrival_rate, service_rate, servicers = np.broadcast_arrays(
+        np.asarray(arrival_rate, dtype = float),
+        np.asarray(service_rate, dtype = float),
+        np.asarray(servicers, dtype = int),
+        )
+
+    load = arrival_rate / service_rate
+
+    rho = load / servicers
+
+    erlang_b = np.ones(load.shape)
+
+    for k in range(1, servicers.max(initial = 0) + 1):
+
+        erlang_b = np.where(
+            k <= servicers, load * erlang_b / (k + load * erlang_b), erlang_b
+            )
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        erlang_c = servicers * erlang_b / (servicers - load * (1 - erlang_b))
+
+        waiting_time = erlang_c / (servicers * service_rate - arrival_rate)
+
+    waiting_time = np.where(rho < 1, np.nan_to_num(waiting_time, nan = 0), np.inf)
+
+    return np.minimum(np.clip(waiting_time, 0, np.inf), max_time)
+
+def benchmark_erlang_c(ports = range(1, 65), n = 100, rho_bounds = (.01, .99), **kwargs):
+    '''
+    Compares erlang_c_waiting_time against mmc_queue across numbers of ports
+
+    For each number of ports waiting times are computed for n values of rho with a unit
+    service rate. Returns a dictionary keyed by number of ports with the maximum
+    relative difference where mmc_queue is finite and the run time of each function.
+    '''
+
+    service_rate = kwargs.get('service_rate', 1)
+
+    rho = np.linspace(*rho_bounds, n)
+
+    results = {}
+
+    for servicers in ports:
+
+        arrival_rate = rho * service_rate * servicers
+
+        t0 = time.time()
+
+        reference = np.array(
+            [mmc_queue(a, service_rate, servicers) for a in arrival_rate]
+            )
+
+        reference_time = time.time() - t0
+
+        t0 = time.time()
+
+        vectorized = erlang_c_waiting_time(arrival_rate, service_rate, servicers)
+
+        vectorized_time = time.time() - t0
+
+        finite = np.isfinite(reference)
+
+        difference = np.abs(vectorized[finite] - reference[finite]) / np.clip(
+            np.abs(reference[finite]), np.finfo(float).tiny, np.inf
+            )
+
+        results[servicers] = {
+            'max_relative_difference': difference.max(initial = 0),
+            'finite': finite.sum(),
+            'mmc_queue_time': reference_time,
+            'erlang_c_time': vectorized_time,
+        }
+
+    return results
+
 def queuing_time_distribution(n, rho, power, **kwargs):
 
     rho = rho[rho <= .99]
@@ -233,26 +514,206 @@ def queuing_time_distribution(n, rho, power, **kwargs):
 
     service_rate = service_rate_distribution(rho)
 
-    waiting_time = np.zeros(len(rho))
-    
-    for idx in range(len(rho)):
+    arrival_rate = rho * service_rate * n
 
-        arrival_rate = rho[idx] * service_rate[idx] * n
-        # print(n)
+    waiting_time = erlang_c_waiting_time(
+        arrival_rate, service_rate, n,
+        max_time = kwargs.get('max_time', np.inf),
+        )
 
-        waiting_time[idx] = mmc_queue(
-            arrival_rate, service_rate[idx], n,
-            max_time = kwargs.get('max_time', np.inf),
+    histogram = np.histogram(
+        waiting_time, **kwargs.get(
+            'histogram', {'bins': np.arange(0, max([max(waiting_time), 60]) + 60, 60)}
+            )
         )
 
-    # print(n, max(waiting_time))
+    if kwargs.get('distribution', 'sampler') == 'histogram':
+
+        return rv_histogram(histogram)
+
+    return QueuingTimeSampler(histogram)
+
+class QueuingTimeSampler():
+    '''
+    Lightweight inverse-CDF sampler for a histogram distribution
+
+    Equivalent to scipy.stats.rv_histogram for sampling (the same random_state yields
+    the same draws up to round-off) without the distribution machinery overhead. The
+    CDF table is precomputed at the bin edges and uniform draws are located with
+    searchsorted and interpolated linearly within bins. Holds only arrays so it pickles
+    cheaply for worker processes.
+    '''
+
+    def __init__(self, histogram):
+
+        counts, bins = histogram
+
+        self.bins = np.asarray(bins, dtype = float)
+
+        widths = np.diff(self.bins)
+
+        density = np.asarray(counts, dtype = float)
+
+        # Unequal bins are treated as densities as in rv_histogram
+        if np.allclose(widths, widths[0]):
+
+            density = density / widths
 
-    dist = rv_histogram(
-        np.histogram(
-            waiting_time, **kwargs.get(
-                'histogram', {'bins': np.arange(0, max([max(waiting_time), 60]) + 60, 60)}
+        density = density / np.sum(density * widths)
+
+        self.cdf_table = np.hstack([0., np.cumsum(density * widths)])
+
+    def ppf(self, q):
+
+        q = np.asarray(q, dtype = float)
+
+        idx = np.clip(
+            np.searchsorted(self.cdf_table, q, side = 'right') - 1,
+            0, len(self.bins) - 2,
+            )
+
+        cdf_low = self.cdf_table[idx]
+        cdf_high = self.cdf_table[idx + 1]
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+            fraction = np.where(
+                cdf_high > cdf_low, (q - cdf_low) / (cdf_high - cdf_low), 0
                 )
+
+        return self.bins[idx] + fraction * (self.bins[idx + 1] - self.bins[idx])
+
+    def cdf(self, x):
+
+        return np.interp(x, self.bins, self.cdf_table)
+
+    def mean(self):
+
+        centers = (self.bins[1:] + self.bins[:-1]) / 2
+
+        return np.sum(centers * np.diff(self.cdf_table))
+
+    def rvs(self, size = None, random_state = None):
+
+        if not isinstance(random_state, np.random.Generator):
+
+            random_state = np.random.default_rng(random_state)
+
+        return self.ppf(random_state.uniform(size = size))
+
+def sample_queuing_times(samplers, size = 1, random_state = None):
+    '''
+    Draws size samples from each of a list of samplers in one pass
+
+    Samplers shared between stations (as produced by QueuingCache) are evaluated once
+    for all of their rows. Returns a (len(samplers), size) array.
+    '''
+
+    if not isinstance(random_state, np.random.Generator):
+
+        random_state = np.random.default_rng(random_state)
+
+    uniform = random_state.uniform(size = (len(samplers), size))
+
+    samples = np.empty_like(uniform)
+
+    groups = {}
+
+    for idx, sampler in enumerate(samplers):
+
+        groups.setdefault(id(sampler), (sampler, []))[1].append(idx)
+
+    for sampler, rows in groups.values():
+
+        samples[rows] = sampler.ppf(uniform[rows])
+
+    return samples
+
+def _freeze(value):
+    '''
+    Converts nested dictionaries, lists, and arrays into hashable tuples
+    '''
+
+    if isinstance(value, dict):
+
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+
+    if isinstance(value, (list, tuple, np.ndarray)):
+
+        return tuple(_freeze(v) for v in value)
+
+    if isinstance(value, np.generic):
+
+        return value.item()
+
+    if isinstance(value, Hashable):
+
+        return value
+
+    return repr(value)
+
+class QueuingCache():
+    '''
+    Bounded least-recently-used cache of queuing time distributions
+
+    Distributions are keyed by (n, rho, power, kwargs) so that stations sharing the same
+    number of ports, power, risk attitude, and queue parameters share one distribution.
+    Hits and misses are counted for auditing.
+    '''
+
+    def __init__(self, maxsize = 1024):
+
+        self.maxsize = maxsize
+
+        self.store = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, n, rho, power, **kwargs):
+
+        key = (
+            int(n),
+            _freeze(np.asarray(rho, dtype = float)),
+            float(power),
+            _freeze(kwargs),
             )
-        )
 
-    return dist
\ No newline at end of file
+        if key in self.store:
+
+            self.hits += 1
+
+            self.store.move_to_end(key)
+
+            return self.store[key]
+
+        self.misses += 1
+
+        dist = queuing_time_distribution(n, rho, power, **kwargs)
+
+        self.store[key] = dist
+
+        while len(self.store) > self.maxsize:
+
+            self.store.popitem(last = False)
+
+        return dist
+
+    def clear(self):
+
+        self.store.clear()
+
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.store),
+            'maxsize': self.maxsize,
+        }
+
+# Process-wide cache shared by all stations unless another is provided
+queuing_cache = QueuingCache()
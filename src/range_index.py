@@ -0,0 +1,134 @@
+'''
+Module for range-indexed adjacency
+
+A Vehicle can traverse an edge only if its distance lies in [min_edge_distance, range]
+(min_edge_distance applying only to edges to stations). On a complete SNG most edges
+fail this check but dijkstra still visits each of them. RangeIndex sorts the out-edges
+of each node by distance per edge type so that the feasible neighbors of a node for a
+vehicle are a contiguous slice found by binary search.
+
+Routing engines take the slices through the neighbors kwarg:
+
+neighbors = RangeIndex(graph).neighbors(vehicle)
+
+all_pairs_shortest_paths(graph, origins, objective = vehicle, neighbors = neighbors)
+
+The index assumes that edge feasibility is given by Vehicle.edge_feasible as is the
+case for graphs costed with supply_costs or Overlay. Edges within range are still
+checked by the engines. Ties between routes may be broken differently than without
+the index (see johnson.py).
+'''
+import numpy as np
+
+class RangeIndex():
+    '''
+    Out-edges of each node sorted by distance per edge type
+
+    args:
+
+    graph - graph or Overlay with edge types (see routing.edge_types)
+    field - edge attribute by which edges are sorted
+    '''
+
+    def __init__(self, graph, field = 'distance'):
+
+        self.field = field
+
+        self.adjacency = {}
+
+        for source, adj in graph._adj.items():
+
+            groups = {}
+
+            for target, edge in adj.items():
+
+                groups.setdefault(edge.get('type', ''), []).append(
+                    (edge.get(field, np.inf), target, edge)
+                    )
+
+            self.adjacency[source] = {}
+
+            for edge_type, group in groups.items():
+
+                order = np.argsort([item[0] for item in group], kind = 'stable')
+
+                self.adjacency[source][edge_type] = (
+                    np.array([group[idx][0] for idx in order], dtype = float),
+                    [group[idx][1] for idx in order],
+                    [group[idx][2] for idx in order],
+                    )
+
+    def bounds(self, vehicle, edge_type):
+        '''
+        Returns the feasible distance interval of an edge type for vehicle
+        '''
+
+        if edge_type == 'to_station':
+
+            return vehicle.min_edge_distance, vehicle.range
+
+        return 0, vehicle.range
+
+    def slices(self, source, vehicle):
+        '''
+        Returns the (target, edge) pairs out of source which are within range of vehicle
+        '''
+
+        pairs = []
+
+        for edge_type, (distances, targets, edges) in self.adjacency[source].items():
+
+            lower, upper = self.bounds(vehicle, edge_type)
+
+            start = np.searchsorted(distances, lower, side = 'left')
+            stop = np.searchsorted(distances, upper, side = 'right')
+
+            pairs.extend(zip(targets[start:stop], edges[start:stop]))
+
+        return pairs
+
+    def neighbors(self, vehicle):
+        '''
+        Returns a RangeNeighbors function for vehicle to be passed to routing engines
+        '''
+
+        return RangeNeighbors(self, vehicle)
+
+class RangeNeighbors():
+    '''
+    Function of source returning the in-range (target, edge) pairs out of source for a
+    vehicle. Slices are computed on first use and kept.
+    '''
+
+    def __init__(self, index, vehicle):
+
+        self.index = index
+        self.vehicle = vehicle
+
+        self.pairs = {}
+
+    def __call__(self, source):
+
+        pairs = self.pairs.get(source, None)
+
+        if pairs is None:
+
+            pairs = self.index.slices(source, self.vehicle)
+
+            self.pairs[source] = pairs
+
+        return pairs
+
+    def fraction(self):
+        '''
+        Fraction of the out-edges of the sources used so far which are in range
+        '''
+
+        used = sum(len(pairs) for pairs in self.pairs.values())
+
+        total = sum(
+            len(group[0]) for source in self.pairs.keys()
+            for group in self.index.adjacency[source].values()
+            )
+
+        return used / max([total, 1])
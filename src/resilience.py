@@ -0,0 +1,498 @@
+'''
+Module for incremental station-removal resilience sweeps
+
+A resilience sweep removes one station at a time and reroutes between all origins.
+Rerunning all_pairs_shortest_paths for every removal repeats the work for every origin
+even though most shortest path trees do not pass through the removed station.
+StationRemoval routes each origin once, records which stations lie on the tree paths
+from each origin to its destinations, and, after a removal, repairs only the trees of
+the origins which used the station.
+
+Removing edges can only lengthen paths so the nodes whose tree paths avoid the removed
+station keep their distances. A tree is repaired by invalidating the subtree below the
+station, seeding each invalidated node from its valid in-neighbors, and running a
+compiled Dijkstra over the invalidated nodes only.
+
+Costs must be additive scalars as for the johnson engine (see johnson.py). Tree paths
+which fail the objective on replay (for example path_limit) are rerouted with the
+objective-driven dijkstra around the removed station.
+'''
+import time
+import heapq
+
+import numpy as np
+
+from numba import jit
+
+from .progress_bar import ProgressBar
+from .johnson import replay_path, route_infeasible, recover_path, _dijkstra_tree
+from .lanes import csr_from_adjacency
+
+class StationRemoval():
+    '''
+    Incremental all-pairs routing under single-station removals
+
+    args:
+
+    graph - costed graph or Overlay (see supply_costs and overlay.py)
+    origins - nodes routed between as in all_pairs_shortest_paths
+    objective - additive scalar Objective object (see routing.shortest_paths)
+
+    kwargs:
+
+    stations - nodes which may be removed. Defaults to the nodes with a station
+    which are not origins.
+    return_paths - if False paths are not returned
+    progress_bar_kw - kwargs for the progress bar of the baseline run
+    '''
+
+    def __init__(self, graph, origins, objective, **kwargs):
+
+        self.graph = graph
+        self.origins = list(origins)
+        self.objective = objective
+
+        self.return_paths = kwargs.get('return_paths', True)
+
+        if getattr(objective, 'cases', 1) > 1:
+
+            raise ValueError(
+                'StationRemoval requires an additive scalar objective (cases = 1)'
+                )
+
+        self.nodes, self.index, self.indptr, self.indices = csr_from_adjacency(graph)
+
+        self.weights = self._weights()
+
+        # Reverse CSR holding the source and edge index of the in-edges of each node
+        order = np.argsort(self.indices, kind = 'stable')
+
+        self.rindptr = np.zeros(len(self.nodes) + 1, dtype = np.int64)
+        self.rindptr[1:] = np.cumsum(
+            np.bincount(self.indices, minlength = len(self.nodes))
+            )
+
+        self.rsources = np.repeat(
+            np.arange(len(self.nodes)), np.diff(self.indptr)
+            )[order]
+
+        self.redges = order.astype(np.int64)
+
+        self.terminal = np.zeros(len(self.nodes), dtype = np.bool_)
+        self.terminal[[self.index[o] for o in self.origins]] = True
+
+        self.destinations = np.array(
+            [self.index[o] for o in self.origins], dtype = np.int64
+            )
+
+        stations = kwargs.get('stations', None)
+
+        if stations is None:
+
+            stations = [
+                k for k, v in graph._node.items()
+                if (v.get('station', None) is not None) and
+                (not self.terminal[self.index[k]])
+                ]
+
+        self.stations = list(stations)
+
+        self.info = {
+            'origins': len(self.origins),
+            'removals': 0,
+            'recomputed': 0,
+            'settled_baseline': 0,
+            'settled_repair': 0,
+            'baseline_time': 0.,
+            'removal_time': 0.,
+        }
+
+        t0 = time.time()
+
+        self.trees = {}
+        self.results = {}
+        self.users = {station: [] for station in self.stations}
+
+        # Origins with rerouted destinations whose paths are not on their trees
+        self.rerouted = []
+
+        is_station = np.zeros(len(self.nodes), dtype = np.bool_)
+        is_station[[self.index[s] for s in self.stations]] = True
+
+        for origin in ProgressBar(self.origins, **kwargs.get('progress_bar_kw', {})):
+
+            idx = self.index[origin]
+
+            distances, predecessors, edges, order = _dijkstra_tree(
+                self.indptr, self.indices, self.weights, idx, self.terminal,
+                )
+
+            self.trees[origin] = (distances, predecessors, edges, order)
+            costs, values, paths, rerouted = self._origin_results(
+                idx, distances, predecessors
+                )
+
+            self.results[origin] = (costs, values, paths)
+
+            if rerouted:
+
+                self.rerouted.append(origin)
+
+            self.info['settled_baseline'] += len(order)
+
+            used = _path_nodes(predecessors, self.destinations, distances, idx)
+
+            for node in np.flatnonzero(used & is_station):
+
+                self.users[self.nodes[node]].append(origin)
+
+        self.info['baseline_time'] = time.time() - t0
+
+    def _weights(self):
+        '''
+        Returns the scalar cost of each edge in CSR order, infinite if infeasible
+        '''
+
+        objective = self.objective
+
+        infinity = objective.infinity()
+
+        weights = np.full(len(self.indices), np.inf)
+
+        idx = 0
+
+        for source, adj in self.graph._adj.items():
+            for target, edge in adj.items():
+
+                if edge.get('feasible', True):
+
+                    values, feasible = objective.update(objective.initial(), edge)
+
+                    if feasible:
+
+                        weights[idx], _ = objective.compare(values, infinity)
+
+                idx += 1
+
+        return weights
+
+    def _origin_results(self, idx, distances, predecessors, station = None):
+        '''
+        Returns the costs, values, and paths dictionaries of one origin from its tree
+        and whether any destination was rerouted
+
+        Destinations whose tree path fails the objective on replay are rerouted with
+        route_infeasible without passing through station.
+        '''
+
+        costs = {}
+        values = {}
+        paths = {}
+
+        infeasible = []
+
+        infinity = self.objective.infinity()
+
+        reached = [self.nodes[k] for k in np.flatnonzero(np.isfinite(distances))]
+
+        for destination in np.intersect1d(reached, self.origins):
+
+            path = recover_path(
+                self.nodes, predecessors, idx, self.index[destination]
+                )
+
+            cost, path_values, path_feasible = replay_path(
+                self.graph, self.objective, path, infinity
+                )
+
+            if not path_feasible:
+
+                infeasible.append(destination)
+
+                continue
+
+            costs[destination] = cost
+            values[destination] = path_values
+
+            if self.return_paths:
+
+                paths[destination] = path
+
+        if infeasible:
+
+            neighbors = None
+
+            if station is not None:
+
+                neighbors = lambda node: [
+                    (target, edge) for target, edge in self.graph._adj[node].items()
+                    if target != station
+                    ]
+
+            route_infeasible(
+                self.graph, self.objective, self.nodes[idx], infeasible,
+                costs, values, paths,
+                destinations = self.origins,
+                neighbors = neighbors,
+                return_paths = self.return_paths,
+                )
+
+        return costs, values, paths, bool(infeasible)
+
+    def removed_weights(self, station):
+        '''
+        Returns the edge weights with the in-edges and out-edges of station removed
+        '''
+
+        idx = self.index[station]
+
+        weights = self.weights.copy()
+
+        weights[self.indptr[idx]:self.indptr[idx + 1]] = np.inf
+        weights[self.redges[self.rindptr[idx]:self.rindptr[idx + 1]]] = np.inf
+
+        return weights
+
+    def remove(self, station):
+        '''
+        Returns costs, values, and paths as in all_pairs_shortest_paths for the graph
+        with station removed. Only the trees of origins which used station are
+        repaired. The baseline is not modified.
+        '''
+
+        t0 = time.time()
+
+        weights = self.removed_weights(station)
+
+        idx_s = self.index[station]
+
+        costs = {}
+        values = {}
+        paths = {}
+
+        for origin in self.origins:
+
+            origin_costs, origin_values, origin_paths = self.results[origin]
+
+            costs[origin] = origin_costs
+            values[origin] = origin_values
+            paths[origin] = origin_paths
+
+        # Rerouted paths may use station without it being on the tree
+        origins = set(self.users.get(station, [])) | set(self.rerouted)
+
+        for origin in [o for o in self.origins if o in origins]:
+
+            idx = self.index[origin]
+
+            distances, predecessors, edges, order = self.trees[origin]
+
+            invalid = _subtree(order, predecessors, idx_s)
+
+            distances, predecessors, edges, settled = _repair_tree(
+                self.indptr, self.indices, weights,
+                self.rindptr, self.rsources, self.redges,
+                distances, predecessors, edges, invalid, self.terminal, idx,
+                )
+
+            origin_costs, origin_values, origin_paths, _ = self._origin_results(
+                idx, distances, predecessors, station
+                )
+
+            costs[origin] = origin_costs
+            values[origin] = origin_values
+            paths[origin] = origin_paths
+
+            self.info['recomputed'] += 1
+            self.info['settled_repair'] += settled
+
+        self.info['removals'] += 1
+        self.info['removal_time'] += time.time() - t0
+
+        if not self.return_paths:
+
+            paths = None
+
+        return costs, values, paths
+
+    def sweep(self, stations = None, function = None, **kwargs):
+        '''
+        Removes each of stations (default all) in turn
+
+        If function is provided it is called as function(costs, values, paths) for each
+        removal and its output is kept in place of the results. Returns a dictionary
+        keyed by station.
+        '''
+
+        stations = self.stations if stations is None else stations
+
+        out = {}
+
+        for station in ProgressBar(stations, **kwargs.get('progress_bar_kw', {})):
+
+            results = self.remove(station)
+
+            out[station] = results if function is None else function(*results)
+
+        return out
+
+    def statistics(self):
+        '''
+        Returns the sweep counters together with the fraction of origins recomputed per
+        removal and the ratio of nodes settled by repairs to nodes settled by full
+        reruns of the same removals
+        '''
+
+        info = dict(self.info)
+
+        removals = max([info['removals'], 1])
+
+        info['fraction_recomputed'] = (
+            info['recomputed'] / (removals * max([info['origins'], 1]))
+            )
+
+        info['fraction_settled'] = (
+            info['settled_repair'] / (removals * max([info['settled_baseline'], 1]))
+            )
+
+        return info
+
+@jit(nopython = True, cache = True)
+def _path_nodes(predecessors, destinations, distances, origin):
+    '''
+    Flags the nodes strictly between origin and a reached destination on the tree
+    '''
+
+    used = np.zeros(len(predecessors), dtype = np.bool_)
+
+    for destination in destinations:
+
+        if distances[destination] == np.inf or destination == origin:
+
+            continue
+
+        node = predecessors[destination]
+
+        while node != origin and not used[node]:
+
+            used[node] = True
+
+            node = predecessors[node]
+
+    return used
+
+@jit(nopython = True, cache = True)
+def _subtree(order, predecessors, root):
+    '''
+    Flags root and the nodes whose tree path passes through root
+    '''
+
+    invalid = np.zeros(len(predecessors), dtype = np.bool_)
+
+    invalid[root] = True
+
+    for node in order:
+
+        if node != root and predecessors[node] != node:
+
+            if invalid[predecessors[node]]:
+
+                invalid[node] = True
+
+    return invalid
+
+@jit(nopython = True, cache = True)
+def _repair_tree(
+    indptr, indices, weights, rindptr, rsources, redges,
+    distances, predecessors, edges, invalid, terminal, origin,
+    ):
+    '''
+    Recomputes the distances of the invalid nodes of a tree after edge removals
+
+    Valid nodes keep their distances. Each invalid node is seeded from its valid
+    in-neighbors and Dijkstra is run over the invalid nodes. Returns distances,
+    predecessors, tree edges, and the number of nodes settled.
+    '''
+
+    n = len(indptr) - 1
+
+    distances = distances.copy()
+    predecessors = predecessors.copy()
+    edges = edges.copy()
+
+    settled = np.zeros(n, dtype = np.bool_)
+
+    heap = [(0., origin)]
+    heap.pop()
+
+    for node in range(n):
+
+        if invalid[node]:
+
+            distances[node] = np.inf
+            predecessors[node] = -1
+            edges[node] = -1
+
+    for node in range(n):
+
+        if not invalid[node]:
+
+            continue
+
+        for k in range(rindptr[node], rindptr[node + 1]):
+
+            source = rsources[k]
+
+            if invalid[source] or (terminal[source] and (source != origin)):
+
+                continue
+
+            distance = distances[source] + weights[redges[k]]
+
+            if distance < distances[node]:
+
+                distances[node] = distance
+                predecessors[node] = source
+                edges[node] = redges[k]
+
+        if distances[node] < np.inf:
+
+            heapq.heappush(heap, (distances[node], node))
+
+    count = 0
+
+    while heap:
+
+        distance, source = heapq.heappop(heap)
+
+        if settled[source]:
+
+            continue
+
+        settled[source] = True
+
+        count += 1
+
+        if terminal[source] and (source != origin):
+
+            continue
+
+        for idx in range(indptr[source], indptr[source + 1]):
+
+            target = indices[idx]
+
+            if not invalid[target]:
+
+                continue
+
+            distance_target = distance + weights[idx]
+
+            if distance_target < distances[target]:
+
+                distances[target] = distance_target
+                predecessors[target] = source
+                edges[target] = idx
+
+                heapq.heappush(heap, (distance_target, target))
+
+    return distances, predecessors, edges, count
@@ -0,0 +1,340 @@
+'''
+Module for dense storage of all-pairs routing results
+
+all_pairs_shortest_paths returns values[origin][destination][field] as nested
+dictionaries holding one cases-length array per field. AllPairsResults stores the same
+information in a single (origins, destinations, fields, cases) array with id to index
+maps and provides dictionary-like access so that existing consumers (gravity,
+impedance, plotting) continue to work.
+
+Results can be saved to and loaded from .npz files or as .npy arrays with a .json
+metadata file, the latter of which can be memory-mapped.
+'''
+import json
+
+import numpy as np
+
+from collections.abc import Mapping
+
+from .graph import NpEncoder
+
+class AllPairsResults(Mapping):
+    '''
+    Dense container for all-pairs routing values
+
+    values - (origins, destinations, fields, cases) array, infinite where no path
+    costs - (origins, destinations) array of path costs, infinite where no path
+    origins, destinations, fields - ids for each axis
+
+    results[origin][destination][field] returns a cases-length view of values.
+    Unreachable destinations are omitted from results[origin] as in the nested
+    dictionaries. Scalar values are stored under the field None and
+    results[origin][destination] then returns the cases-length view directly.
+    '''
+
+    def __init__(self, values, costs, origins, destinations, fields):
+
+        self.values = values
+        self.costs = costs
+
+        self.origins = list(origins)
+        self.destinations = list(destinations)
+        self.fields = list(fields)
+
+        self.origin_index = {k: idx for idx, k in enumerate(self.origins)}
+        self.destination_index = {k: idx for idx, k in enumerate(self.destinations)}
+        self.field_index = {k: idx for idx, k in enumerate(self.fields)}
+
+    @classmethod
+    def from_nested(
+        cls, costs, values, origins = None, destinations = None, fields = None,
+        ):
+        '''
+        Builds a container from the nested dictionaries of all_pairs_shortest_paths.
+        If costs is None the cost array is left infinite.
+        '''
+
+        origins = list(values.keys()) if origins is None else list(origins)
+
+        if destinations is None:
+
+            destinations = []
+
+            for origin in origins:
+                for destination in values[origin].keys():
+
+                    if destination not in destinations:
+
+                        destinations.append(destination)
+
+        sample = None
+
+        for origin in origins:
+            for destination in values[origin].keys():
+
+                sample = values[origin][destination]
+
+                break
+
+            if sample is not None:
+
+                break
+
+        fields, cases = _fields_cases(sample, fields)
+
+        array = np.full((len(origins), len(destinations), len(fields), cases), np.inf)
+        cost_array = np.full((len(origins), len(destinations)), np.inf)
+
+        destination_index = {k: idx for idx, k in enumerate(destinations)}
+
+        for idx_o, origin in enumerate(origins):
+
+            _fill(
+                array, cost_array, idx_o, None if costs is None else costs[origin],
+                values[origin], destination_index, fields,
+                )
+
+        return cls(array, cost_array, origins, destinations, fields)
+
+    @classmethod
+    def from_results(cls, results, origins, destinations = None):
+        '''
+        Builds a container from the (origin, costs, values, paths) tuples yielded by
+        routing.iter_all_pairs_shortest_paths filling the array one origin at a time
+        so that the nested values dictionaries of all origins are never held at once
+
+        destinations defaults to origins. Returns the container and the nested costs
+        and paths dictionaries.
+        '''
+
+        origins = list(origins)
+        destinations = origins if destinations is None else list(destinations)
+
+        origin_index = {k: idx for idx, k in enumerate(origins)}
+        destination_index = {k: idx for idx, k in enumerate(destinations)}
+
+        array = None
+        cost_array = np.full((len(origins), len(destinations)), np.inf)
+
+        fields = None
+
+        costs = {}
+        paths = {}
+
+        for origin, origin_costs, origin_values, origin_paths in results:
+
+            costs[origin] = origin_costs
+            paths[origin] = origin_paths
+
+            # Array is allocated once the first reached destination gives its shape
+            if (array is None) and origin_values:
+
+                fields, cases = _fields_cases(next(iter(origin_values.values())))
+
+                array = np.full(
+                    (len(origins), len(destinations), len(fields), cases), np.inf
+                    )
+
+            if array is not None:
+
+                _fill(
+                    array, cost_array, origin_index[origin], origin_costs,
+                    origin_values, destination_index, fields,
+                    )
+
+        if array is None:
+
+            fields = [None]
+
+            array = np.full((len(origins), len(destinations), 1, 1), np.inf)
+
+        if all(p is None for p in paths.values()):
+
+            paths = None
+
+        return cls(array, cost_array, origins, destinations, fields), costs, paths
+
+    def field(self, field):
+        '''
+        Returns the (origins, destinations, cases) array for a field
+        '''
+
+        return self.values[:, :, self.field_index[field]]
+
+    def reached(self):
+        '''
+        Returns the (origins, destinations) mask of pairs with a path
+        '''
+
+        return np.isfinite(self.costs)
+
+    def __getitem__(self, origin):
+
+        return _OriginView(self, self.origin_index[origin])
+
+    def __iter__(self):
+
+        return iter(self.origins)
+
+    def __len__(self):
+
+        return len(self.origins)
+
+    def _metadata(self):
+
+        return {
+            'origins': self.origins,
+            'destinations': self.destinations,
+            'fields': self.fields,
+        }
+
+    def save(self, filename):
+        '''
+        Saves to filename.npz if filename ends with .npz otherwise to filename.npy
+        (values), filename_costs.npy, and filename.json (ids)
+        '''
+
+        metadata = json.dumps(self._metadata(), cls = NpEncoder)
+
+        if filename.endswith('.npz'):
+
+            np.savez(
+                filename, values = self.values, costs = self.costs, metadata = metadata,
+                )
+
+        else:
+
+            np.save(filename + '.npy', self.values)
+            np.save(filename + '_costs.npy', self.costs)
+
+            with open(filename + '.json', 'w') as file:
+
+                file.write(metadata)
+
+    @classmethod
+    def load(cls, filename, mmap_mode = None):
+        '''
+        Loads from a file written by save. mmap_mode (e.g. 'r') memory-maps the .npy
+        arrays and is ignored for .npz files.
+        '''
+
+        if filename.endswith('.npz'):
+
+            with np.load(filename) as data:
+
+                values = data['values']
+                costs = data['costs']
+                metadata = json.loads(str(data['metadata']))
+
+        else:
+
+            values = np.load(filename + '.npy', mmap_mode = mmap_mode)
+            costs = np.load(filename + '_costs.npy', mmap_mode = mmap_mode)
+
+            with open(filename + '.json', 'r') as file:
+
+                metadata = json.load(file)
+
+        return cls(
+            values, costs,
+            metadata['origins'], metadata['destinations'], metadata['fields'],
+            )
+
+class _OriginView(Mapping):
+
+    def __init__(self, results, idx_o):
+
+        self.results = results
+        self.idx_o = idx_o
+
+    def __getitem__(self, destination):
+
+        idx_d = self.results.destination_index[destination]
+
+        if not np.isfinite(self.results.costs[self.idx_o, idx_d]):
+
+            raise KeyError(destination)
+
+        if self.results.fields == [None]:
+
+            return self.results.values[self.idx_o, idx_d, 0]
+
+        return _PairView(self.results, self.idx_o, idx_d)
+
+    def __iter__(self):
+
+        reached = np.isfinite(self.results.costs[self.idx_o])
+
+        return (d for d, r in zip(self.results.destinations, reached) if r)
+
+    def __len__(self):
+
+        return int(np.isfinite(self.results.costs[self.idx_o]).sum())
+
+class _PairView(Mapping):
+
+    def __init__(self, results, idx_o, idx_d):
+
+        self.results = results
+        self.idx_o = idx_o
+        self.idx_d = idx_d
+
+    def __getitem__(self, field):
+
+        return self.results.values[
+            self.idx_o, self.idx_d, self.results.field_index[field]
+            ]
+
+    def __iter__(self):
+
+        return iter(self.results.fields)
+
+    def __len__(self):
+
+        return len(self.results.fields)
+
+def _fields_cases(sample, fields = None):
+    '''
+    Returns the fields and number of cases of the values of one pair
+    '''
+
+    if fields is None:
+
+        fields = list(sample.keys()) if isinstance(sample, dict) else [None]
+
+    if isinstance(sample, dict):
+
+        cases = len(np.atleast_1d(sample[fields[0]]))
+
+    else:
+
+        cases = len(np.atleast_1d(sample)) if sample is not None else 1
+
+    return fields, cases
+
+def _fill(array, cost_array, idx_o, costs, values, destination_index, fields):
+    '''
+    Writes the values and costs of one origin into row idx_o of the arrays
+    '''
+
+    for destination, pair in values.items():
+
+        if destination not in destination_index:
+
+            continue
+
+        idx_d = destination_index[destination]
+
+        if fields == [None]:
+
+            array[idx_o, idx_d, 0] = pair
+
+        else:
+
+            for idx_f, field in enumerate(fields):
+
+                array[idx_o, idx_d, idx_f] = pair[field]
+
+        if costs is not None:
+
+            cost_array[idx_o, idx_d] = costs[destination]
@@ -1,14 +1,21 @@
 import time
+import inspect
 import numpy as np
 
-from copy import deepcopy
 from scipy.stats import norm
 from scipy.special import factorial
 
 from .progress_bar import ProgressBar
 from .dijkstra import dijkstra
 from .bellman import bellman
-from .queuing import queuing_time_distribution
+from .johnson import (
+    johnson, iter_johnson, csr_from_graph, replay_path, route_infeasible
+    )
+from .floyd_warshall import _floyd_warshall, recover_path
+from .min_plus import min_plus_adjacency
+from .queuing import queuing_time_distribution, sample_queuing_times, queuing_cache
+from .results import AllPairsResults
+from .utilities import process_pool
 
 _network_power = {
     'Tesla': [250e3],
@@ -30,6 +37,95 @@ def super_quantile(x, p = (0, 1), n = 100):
 
     return np.nan_to_num(q_k.mean(), nan = np.inf)
 
+class SuperQuantile():
+    '''
+    Faster equivalent of super_quantile for repeated evaluation
+
+    The mean of linearly interpolated quantiles at n evenly spaced levels in p is a
+    fixed weighted sum of order statistics. Weights are precomputed once per sample
+    length and only the order statistics which carry weight are found (by partition
+    and a sort of that slice). Non-finite inputs fall back to super_quantile.
+    '''
+
+    def __init__(self, p = (0, 1), n = 100):
+
+        self.p = p
+        self.n = n
+
+        self.weights = {}
+
+    def _weights(self, m):
+
+        if m not in self.weights:
+
+            position = np.linspace(self.p[0], self.p[1], self.n) * (m - 1)
+
+            lower = np.floor(position).astype(int)
+            upper = np.minimum(lower + 1, m - 1)
+            fraction = position - lower
+
+            weights = np.zeros(m)
+
+            np.add.at(weights, lower, (1 - fraction) / self.n)
+            np.add.at(weights, upper, fraction / self.n)
+
+            first = lower.min()
+            last = upper.max()
+
+            self.weights[m] = (first, last, weights[first:last + 1])
+
+        return self.weights[m]
+
+    def __call__(self, x, axis = None):
+
+        x = np.asarray(x, dtype = float)
+
+        if axis is None:
+
+            x = x.ravel()
+            axis = -1
+
+        x = np.moveaxis(x, axis, -1)
+
+        if not np.isfinite(x).all():
+
+            if x.ndim == 1:
+
+                return super_quantile(x, self.p, self.n)
+
+            return np.apply_along_axis(super_quantile, -1, x, self.p, self.n)
+
+        first, last, weights = self._weights(x.shape[-1])
+
+        order = np.partition(x, (first, last), axis = -1)[..., first:last + 1]
+
+        return np.sort(order, axis = -1) @ weights
+
+class Case():
+    '''
+    Expectation which selects a single case (picklable replacement for a lambda)
+    '''
+
+    def __init__(self, case = 0):
+
+        self.case = case
+
+    def __call__(self, x, axis = None):
+
+        if axis is None:
+
+            return x[self.case]
+
+        return np.take(x, self.case, axis = axis)
+
+class Label(dict):
+    '''
+    Dictionary of path values which carries the expectation of its routing cost so
+    that the risk measure of each label is computed only once
+    '''
+
+    expectation = None
+
 def origins_destinations(graph, origins, destinations):
 
     for source, adj in graph._adj.items():
@@ -100,10 +196,21 @@ def shortest_paths(graph, origins, method = 'dijkstra', **kwargs):
 
 def all_pairs_shortest_paths(graph, origins, method = 'dijkstra', **kwargs):
     '''
-    Return path costs, path values, and paths using Dijkstra's or Bellman's method
+    Return path costs, path values, and paths using Dijkstra's, Bellman's, or Johnson's
+    method
 
     Produces paths to each origin from each origin
 
+    processes - if greater than 1 (Dijkstra and Bellman only) origins are routed in
+    chunks of chunksize on a process pool. The graph and objective are shipped to each
+    worker once (inherited when processes are forked) and results are merged in
+    origin order.
+
+    method = 'johnson' uses the compiled sparse engine in johnson.py while methods
+    'floyd_warshall' and 'min_plus' use dense engines on the objective's edge costs
+    with non-origin nodes as the only intermediaries. All three require an additive
+    scalar objective (Objective or Vehicle with cases = 1)
+
     Depends on an Objective object which contains the following four functions:
 
     values = initial() - Function which produces the starting values of each problem state
@@ -121,20 +228,90 @@ def all_pairs_shortest_paths(graph, origins, method = 'dijkstra', **kwargs):
     values, savings = compare(values, approximation) - Function for comparing path state
     values with the existing best approximation at the target node. This function returns
     the values argument and a boolean savings.
+
+    neighbors - optional function of a node returning the (target, edge) pairs to be
+    considered out of it, used by all methods except Bellman (see range_index.py)
+
+    dense - if True values are returned as a results.AllPairsResults container backed
+    by a single (origins, destinations, fields, cases) array which supports the same
+    values[origin][destination][field] access. The array is filled as each origin
+    finishes so the nested values of all origins are never held at once.
     '''
 
-    if method == 'dijkstra':
+    if kwargs.pop('dense', False):
 
-        routing_function = dijkstra
+        values, costs, paths = AllPairsResults.from_results(
+            iter_all_pairs_shortest_paths(graph, origins, method = method, **kwargs),
+            origins,
+            )
 
-    elif method == 'bellman':
+        return costs, values, paths
+
+    if method == 'johnson':
+
+        return johnson(graph, origins, destinations = origins, **kwargs)
 
-        routing_function = bellman
+    elif method in ('floyd_warshall', 'min_plus'):
+
+        return dense_all_pairs_shortest_paths(graph, origins, method = method, **kwargs)
 
     costs = {}
     values = {}
     paths = {}
 
+    results = iter_all_pairs_shortest_paths(graph, origins, method = method, **kwargs)
+
+    for origin, origin_costs, origin_values, origin_paths in results:
+
+        costs[origin] = origin_costs
+        values[origin] = origin_values
+        paths[origin] = origin_paths
+
+    return costs, values, paths
+
+def iter_all_pairs_shortest_paths(graph, origins, method = 'dijkstra', **kwargs):
+    '''
+    Generator form of all_pairs_shortest_paths
+
+    Yields (origin, costs, values, paths) for each origin as it finishes, in origin
+    order, so that results can be written out or accumulated (see streaming.py) without
+    holding every origin in memory. Accepts the same kwargs as
+    all_pairs_shortest_paths except dense. The dense methods ('floyd_warshall' and
+    'min_plus') compute all origins before yielding.
+    '''
+
+    if method == 'johnson':
+
+        yield from iter_johnson(graph, origins, destinations = origins, **kwargs)
+
+        return
+
+    elif method in ('floyd_warshall', 'min_plus'):
+
+        costs, values, paths = dense_all_pairs_shortest_paths(
+            graph, origins, method = method, **kwargs
+            )
+
+        for origin in origins:
+
+            yield (
+                origin, costs[origin], values[origin],
+                None if paths is None else paths[origin],
+                )
+
+        return
+
+    processes = kwargs.pop('processes', 1)
+    chunksize = kwargs.pop('chunksize', None)
+
+    if processes > 1:
+
+        yield from _iter_parallel_all_pairs_shortest_paths(
+            graph, origins, method, processes, chunksize, **kwargs
+            )
+
+        return
+
     for origin in ProgressBar(origins, **kwargs.get('progress_bar_kw', {})):
 
         result = shortest_paths(
@@ -144,14 +321,308 @@ def all_pairs_shortest_paths(graph, origins, method = 'dijkstra', **kwargs):
             **kwargs
             )
 
-        costs[origin] = result[0]
-        values[origin] = result[1]
-        paths[origin] = result[2]
+        yield origin, result[0], result[1], result[2]
+
+# Worker-local state for parallel all-pairs routing
+_worker = {}
+
+def _initialize_worker(graph, origins, method, kwargs):
+
+    _worker['graph'] = graph
+    _worker['origins'] = origins
+    _worker['method'] = method
+    _worker['kwargs'] = kwargs
+
+def _route_chunk(chunk):
+
+    results = []
+
+    for origin in chunk:
+
+        result = shortest_paths(
+            _worker['graph'], [origin],
+            destinations = _worker['origins'],
+            method = _worker['method'],
+            **_worker['kwargs']
+            )
+
+        results.append((origin, result))
+
+    return results
+
+def _iter_parallel_all_pairs_shortest_paths(
+    graph, origins, method, processes, chunksize, **kwargs
+    ):
+
+    progress_bar_kw = kwargs.pop('progress_bar_kw', {})
+
+    if chunksize is None:
+
+        chunksize = max([int(np.ceil(len(origins) / (processes * 4))), 1])
+
+    chunks = [
+        origins[idx:idx + chunksize] for idx in range(0, len(origins), chunksize)
+        ]
+
+    args = (graph, origins, method, kwargs)
+
+    try:
+
+        with process_pool(processes, _initialize_worker, args) as pool:
+
+            results = pool.imap(_route_chunk, chunks)
+
+            for _ in ProgressBar(list(range(len(chunks))), **progress_bar_kw):
+
+                for origin, result in next(results):
+
+                    yield origin, result[0], result[1], result[2]
+
+    finally:
+
+        _worker.clear()
+
+def dense_all_pairs_shortest_paths(graph, origins, method = 'floyd_warshall', **kwargs):
+    '''
+    All-pairs routing between origins on a dense matrix of objective edge costs
+
+    Non-origin nodes are the only intermediaries allowed which matches the behavior of
+    the Dijkstra-based all_pairs_shortest_paths. Pairs whose path fails the objective
+    on replay (for example path_limit) are rerouted with the objective-driven dijkstra
+    (see johnson.route_infeasible). Returns nested dictionaries in the same format as
+    all_pairs_shortest_paths.
+    '''
+
+    objective = kwargs['objective']
+    return_paths = kwargs.get('return_paths', True)
+
+    origins = list(origins)
+
+    if getattr(objective, 'cases', 1) > 1:
+
+        raise ValueError(
+            f'{method} requires an additive scalar objective (cases = 1)'
+            )
+
+    nodes, index, indptr, indices, weights = csr_from_graph(
+        graph, objective, kwargs.get('neighbors', None)
+        )
+
+    n = len(nodes)
+
+    adjacency = np.full((n, n), np.inf)
+    adjacency[np.repeat(np.arange(n), np.diff(indptr)), indices] = weights
+    adjacency[np.arange(n), np.arange(n)] = 0
+
+    places = np.array([index[origin] for origin in origins], dtype = int)
+    pivots = np.setdiff1d(np.arange(n), places)
+
+    if method == 'floyd_warshall':
+
+        costs_matrix, predecessors = _floyd_warshall(
+            adjacency,
+            pivots,
+            np.zeros_like(adjacency),
+            np.zeros_like(adjacency, dtype = int),
+            )
+
+        costs_matrix = costs_matrix[places][:, places]
+
+        get_path = lambda o, d: recover_path(predecessors, places[o], places[d])
+
+    elif method == 'min_plus':
+
+        costs_matrix, _, index_paths = min_plus_adjacency(
+            adjacency[:, :, None], places, stations = pivots,
+            )
+
+        get_path = lambda o, d: index_paths[places[o]][places[d]]
+
+    infinity = objective.infinity()
+
+    costs = {}
+    values = {}
+    paths = {}
+
+    for idx_o, origin in enumerate(origins):
+
+        costs[origin] = {}
+        values[origin] = {}
+        paths[origin] = {}
+
+        infeasible = []
+
+        for idx_d in np.flatnonzero(np.isfinite(costs_matrix[idx_o])):
+
+            destination = origins[idx_d]
+
+            path = [nodes[idx] for idx in get_path(idx_o, idx_d)]
+
+            cost, path_values, path_feasible = replay_path(
+                graph, objective, path, infinity
+                )
+
+            if not path_feasible:
+
+                infeasible.append(destination)
+
+                continue
+
+            costs[origin][destination] = cost
+            values[origin][destination] = path_values
+
+            if return_paths:
+
+                paths[origin][destination] = path
+
+        if infeasible:
+
+            route_infeasible(
+                graph, objective, origin, infeasible,
+                costs[origin], values[origin], paths[origin],
+                destinations = origins,
+                neighbors = kwargs.get('neighbors', None),
+                return_paths = return_paths,
+                )
+
+    if not return_paths:
+
+        paths = None
 
     return costs, values, paths
 
+class Planner():
+    '''
+    Selects a routing engine for all-pairs queries from graph density and query shape
+
+    Multi-case Vehicle objectives are not additive and are routed with Dijkstra. Scalar
+    objectives are routed on dense engines when the share of feasible edges is at least
+    dense_density and the graph has at most max_dense_nodes nodes (min_plus when origins
+    are at most origin_fraction of nodes, otherwise floyd_warshall) and with the
+    compiled sparse engine (johnson) otherwise.
+
+    Each call appends a record of the decision, the inputs to it, and the time taken
+    to log so that thresholds can be audited and tuned.
+
+    The default thresholds (dense_density = .5, max_dense_nodes = 2000, and
+    origin_fraction = .25) are untuned starting points rather than measured break-even
+    values. The dense engines hold (nodes, nodes) arrays so max_dense_nodes mainly
+    bounds memory. Tune the thresholds for a given machine and SNG from the log.
+    '''
+
+    def __init__(self, **kwargs):
+
+        self.dense_density = kwargs.get('dense_density', .5)
+        self.max_dense_nodes = kwargs.get('max_dense_nodes', 2000)
+        self.origin_fraction = kwargs.get('origin_fraction', .25)
+
+        self.log = []
+
+    def plan(self, graph, origins, objective = None):
+
+        n_nodes = graph.number_of_nodes()
+
+        n_edges = 0
+
+        for source, adj in graph._adj.items():
+            for target, edge in adj.items():
+
+                n_edges += bool(edge.get('feasible', True))
+
+        density = n_edges / max([n_nodes ** 2, 1])
+
+        decision = {
+            'n_nodes': n_nodes,
+            'n_edges': n_edges,
+            'density': density,
+            'n_origins': len(origins),
+            'n_destinations': len(origins),
+            'objective': type(objective).__name__,
+            'cases': getattr(objective, 'cases', 1),
+            }
+
+        if decision['cases'] > 1:
+
+            decision['method'] = 'dijkstra'
+            decision['reason'] = 'non-additive multi-case objective'
+
+        elif (density >= self.dense_density) and (n_nodes <= self.max_dense_nodes):
+
+            if len(origins) <= self.origin_fraction * n_nodes:
+
+                decision['method'] = 'min_plus'
+                decision['reason'] = 'dense graph with few origins'
+
+            else:
+
+                decision['method'] = 'floyd_warshall'
+                decision['reason'] = 'dense graph with many origins'
+
+        else:
+
+            decision['method'] = 'johnson'
+            decision['reason'] = 'sparse or large graph'
+
+        return decision
+
+    def __call__(self, graph, origins, **kwargs):
+        '''
+        Plans and runs all_pairs_shortest_paths, returning costs, values, and paths
+        '''
+
+        t0 = time.time()
+
+        decision = self.plan(graph, origins, kwargs.get('objective', None))
+
+        decision['planning_time'] = time.time() - t0
+
+        t0 = time.time()
+
+        result = all_pairs_shortest_paths(
+            graph, origins, method = decision['method'], **kwargs
+            )
+
+        decision['routing_time'] = time.time() - t0
+
+        self.log.append(decision)
+
+        return result
+
+def _results_arrays(values, origins, destinations, kwargs):
+    '''
+    Selects the pairs and masses given by the origins and destinations dictionaries
+    from an AllPairsResults container for the array accessibility metrics
+    '''
+
+    if not origins:
+
+        origins = {k: 1 for k in values.keys()}
+
+    if not destinations:
+
+        destinations = {k: 1 for k in values.keys()}
+
+    origin_ids = list(origins.keys())
+    destination_ids = list(destinations.keys())
+
+    array = values.field(kwargs.get('field', 'total_time'))[np.ix_(
+        [values.origin_index[k] for k in origin_ids],
+        [values.destination_index[k] for k in destination_ids],
+        )]
+
+    kwargs['origin_ids'] = origin_ids
+    kwargs['destination_ids'] = destination_ids
+
+    return array, list(origins.values()), list(destinations.values())
+
 def gravity(values, origins = {}, destinations = {}, **kwargs):
 
+    if isinstance(values, AllPairsResults):
+
+        array, mass_o, mass_d = _results_arrays(values, origins, destinations, kwargs)
+
+        return gravity_array(array, mass_o, mass_d, **kwargs)
+
     field = kwargs.get('field', 'total_time')
     expectation = kwargs.get('expectation', np.mean)
     constant = kwargs.get('constant', 1)
@@ -190,6 +661,12 @@ def gravity(values, origins = {}, destinations = {}, **kwargs):
 
 def impedance(values, origins = {}, destinations = {}, **kwargs):
 
+    if isinstance(values, AllPairsResults):
+
+        array, mass_o, mass_d = _results_arrays(values, origins, destinations, kwargs)
+
+        return impedance_array(array, mass_o, mass_d, **kwargs)
+
     field = kwargs.get('field', 'total_time')
     expectation = kwargs.get('expectation', np.mean)
     constant = kwargs.get('constant', 1)
@@ -229,24 +706,168 @@ def specific_impedance(values, destinations = {}, **kwargs):
     constant = kwargs.get('constant', 1)
 
 
-    if not destinations:
+    if not destinations:
+
+        destinations = {k: 1 for k in values.keys()}
+
+    sum_cost = 0
+
+    n = -1
+
+    for destination, mass_d in destinations.items():
+
+        sum_cost += (
+            constant * mass_d *
+            expectation(np.atleast_1d(values[destination][field]))
+            )
+
+        n += 1
+
+    return sum_cost / n
+
+def _pair_array(values, kwargs):
+    '''
+    Returns the (origins, destinations, cases) array, origin ids, and destination ids
+    for the array accessibility metrics
+    '''
+
+    if isinstance(values, AllPairsResults):
+
+        array = values.field(kwargs.get('field', 'total_time'))
+
+        origin_ids = kwargs.get('origin_ids', values.origins)
+        destination_ids = kwargs.get('destination_ids', values.destinations)
+
+    else:
+
+        array = np.asarray(values, dtype = float)
+
+        if array.ndim == 2:
+
+            array = array[:, :, None]
+
+        origin_ids = kwargs.get('origin_ids', np.arange(array.shape[0]))
+        destination_ids = kwargs.get('destination_ids', np.arange(array.shape[1]))
+
+    return array, np.asarray(origin_ids), np.asarray(destination_ids)
+
+def _mass(mass, n):
+
+    return np.ones(n) if mass is None else np.asarray(mass, dtype = float)
+
+def accepts_axis(function):
+    '''
+    True if the signature of function has an axis parameter (np.mean, SuperQuantile,
+    Case). Functions without an inspectable signature are taken not to.
+    '''
+
+    try:
+
+        parameters = inspect.signature(function).parameters
+
+    except (TypeError, ValueError):
+
+        return False
+
+    return 'axis' in parameters
+
+def expectation_along_cases(expectation, array):
+    '''
+    Applies expectation along the last axis of array in one call if expectation
+    accepts an axis argument (see accepts_axis) and element-wise otherwise
+    '''
+
+    if accepts_axis(expectation):
+
+        return np.asarray(expectation(array, axis = -1), dtype = float)
+
+    return np.apply_along_axis(expectation, -1, array)
+
+def gravity_array(values, origins = None, destinations = None, **kwargs):
+    '''
+    Array version of gravity
+
+    values - (origins, destinations, cases) array or AllPairsResults container
+    origins, destinations - mass vectors aligned with the first two axes of values
+    (default 1)
+
+    kwargs:
+
+    origin_ids, destination_ids - ids used to exclude pairs where origin is
+    destination. Default to the container ids or to positional indices.
+
+    field, expectation, constant, and adjustment are as in gravity. The normalization
+    n counts all origin-destination pairs including excluded ones.
+    '''
+
+    expectation = kwargs.get('expectation', np.mean)
+    constant = kwargs.get('constant', 1)
+    adjustment = kwargs.get('adjustment', 1)
+
+    array, origin_ids, destination_ids = _pair_array(values, kwargs)
+
+    mass_o = _mass(origins, array.shape[0])
+    mass_d = _mass(destinations, array.shape[1])
+
+    different = origin_ids[:, None] != destination_ids[None, :]
+
+    expected = expectation_along_cases(expectation, array)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        terms = (
+            constant * mass_o[:, None] * mass_d[None, :] /
+            (expected / adjustment) ** 2
+            )
+
+    return terms[different].sum() / different.size
+
+def impedance_array(values, origins = None, destinations = None, **kwargs):
+    '''
+    Array version of impedance. See gravity_array for arguments.
+    '''
+
+    expectation = kwargs.get('expectation', np.mean)
+    constant = kwargs.get('constant', 1)
+
+    array, origin_ids, destination_ids = _pair_array(values, kwargs)
+
+    mass_o = _mass(origins, array.shape[0])
+    mass_d = _mass(destinations, array.shape[1])
+
+    different = origin_ids[:, None] != destination_ids[None, :]
+
+    expected = expectation_along_cases(expectation, array)
+
+    terms = constant * mass_o[:, None] * mass_d[None, :] * expected
+
+    return terms[different].sum() / different.size
+
+def specific_impedance_array(values, destinations = None, **kwargs):
+    '''
+    Array version of specific_impedance
+
+    values - (destinations, cases) array of the values from one origin
+    destinations - mass vector aligned with the first axis of values (default 1)
+
+    expectation and constant are as in specific_impedance. The normalization n is the
+    number of destinations less one.
+    '''
 
-        destinations = {k: 1 for k in values.keys()}
+    expectation = kwargs.get('expectation', np.mean)
+    constant = kwargs.get('constant', 1)
 
-    sum_cost = 0
+    array = np.asarray(values, dtype = float)
 
-    n = -1
+    if array.ndim == 1:
 
-    for destination, mass_d in destinations.items():
+        array = array[:, None]
 
-        sum_cost += (
-            constant * mass_d *
-            expectation(np.atleast_1d(values[destination][field]))
-            )
+    mass_d = _mass(destinations, array.shape[0])
 
-        n += 1
+    expected = expectation_along_cases(expectation, array)
 
-    return sum_cost / n
+    return (constant * mass_d * expected).sum() / (array.shape[0] - 1)
 
 class Objective():
 
@@ -290,17 +911,54 @@ def edge_types(graph):
 
     return graph
 
-def supply_costs(graph, vehicle, station_kw):
+def supply_costs(graph, vehicle, station_kw, vectorized = True):
+    '''
+    Builds a Station at each node with a type in station_kw and writes resupply costs
+    for vehicle onto the out-edges of each station. station_kw may also be a
+    StationTable whose views are used as the stations.
+
+    If vectorized is True the costs are computed in one shot by edge_cost_table,
+    otherwise by calling Station.update for each edge. Results are identical.
+    '''
 
     graph = edge_types(graph)
 
-    for source, node in graph._node.items():
+    if isinstance(station_kw, StationTable):
+
+        for source, station in station_kw.stations().items():
+
+            graph._node[source]['station'] = station
+
+    else:
+
+        for source, node in graph._node.items():
+
+            if node['type'] in station_kw:
+
+                kw = station_kw[node['type']]
+
+                node['station'] = Station(node, **kw)
 
-        if node['type'] in station_kw:
+    if vectorized:
 
-            kw = station_kw[node['type']]
+        table = edge_cost_table(graph, vehicle)
 
-            node['station'] = Station(node, **kw)
+        edges = table['edges']
+
+        fields = (
+            'feasible', 'energy', 'charging_time', 'delay_time',
+            'total_time', 'routing_time',
+            )
+
+        for field in fields:
+
+            column = table[field]
+
+            for idx in range(len(edges)):
+
+                edges[idx][field] = column[idx]
+
+        return graph
 
     for source, adj in graph._adj.items():
 
@@ -314,6 +972,144 @@ def supply_costs(graph, vehicle, station_kw):
 
     return graph
 
+def edge_cost_table(graph, vehicle):
+    '''
+    Computes resupply costs for vehicle on every out-edge of every station with NumPy
+
+    Stations must already be attached to nodes (see supply_costs). Returns a dictionary
+    containing the sources, targets, and edge dictionaries of the costed edges and one
+    array per cost field indexed in the same order. For vehicles with multiple cases
+    delay_time holds each station's delay array and total_time and routing_time are
+    (edges, cases) arrays. Results are identical to Station.update.
+    '''
+
+    sources = []
+    targets = []
+    edges = []
+    station_index = []
+
+    stations = []
+
+    for source, adj in graph._adj.items():
+
+        station = graph._node[source].get('station', None)
+
+        if station is None:
+
+            continue
+
+        if vehicle is not station.vehicle:
+
+            station.vehicle = vehicle
+
+            station.estimate()
+
+        for target, edge in adj.items():
+
+            sources.append(source)
+            targets.append(target)
+            edges.append(edge)
+            station_index.append(len(stations))
+
+        stations.append(station)
+
+    station_index = np.array(station_index, dtype = int)
+
+    # Per-station parameters broadcast to edges
+    station_power = np.array([station.power for station in stations])[station_index]
+    station_dc = np.array([station.type == 'dc' for station in stations])[station_index]
+
+    if vehicle.cases == 1:
+
+        delay_time = np.array(
+            [station.delay_time_expected for station in stations]
+            )[station_index]
+
+        delay_time_nominal = np.array(
+            [station.delay_time_nominal_expected for station in stations]
+            )[station_index]
+
+    else:
+
+        delay_time = _stack_cases(
+            [station.delay_time for station in stations], vehicle.cases
+            )[station_index]
+
+        delay_time_nominal = _stack_cases(
+            [station.delay_time_nominal for station in stations], vehicle.cases
+            )[station_index]
+
+    # Per-edge parameters
+    distance = np.array([edge['distance'] for edge in edges], dtype = float)
+    time = np.array([edge['time'] for edge in edges], dtype = float)
+    to_station = np.array([edge.get('type', '') == 'to_station' for edge in edges])
+
+    feasible, energy, charging_time = vehicle.energy_array(
+        station_power, station_dc, distance, to_station
+        )
+
+    # Stations with unlimited power neither delay nor take time to charge
+    unlimited = station_power == np.inf
+
+    charging_time = np.where(unlimited, 0, charging_time)
+
+    if vehicle.cases == 1:
+
+        delay_time = np.where(unlimited, 0, delay_time)
+
+        total_time = time + delay_time + charging_time
+        routing_time = time + delay_time_nominal + charging_time
+
+    else:
+
+        delay_time = np.where(unlimited[:, None], 0, delay_time)
+
+        total_time = time[:, None] + delay_time + charging_time[:, None]
+        routing_time = time[:, None] + delay_time_nominal + charging_time[:, None]
+
+        # Edges share their station's delay array as in Station.update
+        delay_time = [
+            0 if unlimited[idx] else stations[station_index[idx]].delay_time
+            for idx in range(len(edges))
+            ]
+
+    table = {
+        'sources': sources,
+        'targets': targets,
+        'edges': edges,
+        'feasible': feasible,
+        'energy': energy,
+        'charging_time': charging_time,
+        'delay_time': delay_time,
+        'total_time': total_time,
+        'routing_time': routing_time,
+        }
+
+    return table
+
+def _stack_cases(arrays, cases):
+    '''
+    Stacks per-station case arrays into a (stations, cases) array. Stations with one
+    case are broadcast to all cases as they are in Station.update.
+    '''
+
+    rows = []
+
+    for array in arrays:
+
+        array = np.atleast_1d(array)
+
+        if len(array) not in (1, cases):
+
+            raise ValueError(
+                f'station with {len(array)} cases cannot be costed for a vehicle '
+                f'with {cases} cases'
+                )
+
+        rows.append(np.broadcast_to(array, (cases,)))
+
+    return np.array(rows, dtype = float).reshape((-1, cases))
+
 class Vehicle():
 
     def __init__(self, **kwargs):
@@ -338,14 +1134,14 @@ class Vehicle():
 
             self.expectation = kwargs.get(
                 'expectation',
-                lambda x: x[0],
+                Case(0),
                 )
 
         else:
 
             self.expectation = kwargs.get(
                 'expectation',
-                lambda x: super_quantile(x, self.risk_attitude),
+                SuperQuantile(self.risk_attitude),
                 )
             
         self.initial_values = kwargs.get(
@@ -370,11 +1166,11 @@ class Vehicle():
 
 
     def select_case(self, case):
+        '''
+        Returns a CaseView of the vehicle whose expectation is the value of case
+        '''
 
-        new_object = deepcopy(self)
-        new_object.expectation = lambda x: x[case]
-
-        return new_object
+        return CaseView(self, case)
 
     def initial(self):
 
@@ -382,11 +1178,17 @@ class Vehicle():
 
     def infinity(self):
 
-        return {k: np.ones(self.cases) * np.inf for k in self.initial_values.keys()}
+        infinity = Label(
+            {k: np.ones(self.cases) * np.inf for k in self.initial_values.keys()}
+            )
+
+        infinity.expectation = self.expectation(infinity[self.cost])
+
+        return infinity
 
     def update(self, values, edge):
 
-        updated_values = {}
+        updated_values = Label()
 
         updated_values['total_time'] = values['total_time'] + edge['total_time']
         updated_values['routing_time'] = values['routing_time'] + edge['routing_time']
@@ -397,10 +1199,27 @@ class Vehicle():
 
         return updated_values, True
 
+    def label_expectation(self, values):
+        '''
+        Expectation of the routing cost of values, cached on Label objects
+        '''
+
+        expectation = getattr(values, 'expectation', None)
+
+        if expectation is None:
+
+            expectation = self.expectation(values[self.cost])
+
+            if isinstance(values, Label):
+
+                values.expectation = expectation
+
+        return expectation
+
     def compare(self, values, approximation):
 
-        values_expectation = self.expectation(values[self.cost])
-        approximation_expectation  = self.expectation(approximation[self.cost])
+        values_expectation = self.label_expectation(values)
+        approximation_expectation  = self.label_expectation(approximation)
 
         savings = values_expectation < approximation_expectation 
 
@@ -454,6 +1273,37 @@ class Vehicle():
 
         return duration_linear + duration_exponential
 
+    def dc_charge_array(self, initial_soc, final_soc, power, capacity):
+        '''
+        Vectorized dc_charge - all arguments may be arrays
+        '''
+
+        final_soc = np.minimum(final_soc, .99)
+
+        alpha = power / capacity / (1 - self.linear_fraction) # Exponential charging factor
+
+        delta_soc_linear = np.minimum(final_soc, self.linear_fraction) - initial_soc
+
+        duration_linear = np.where(
+            self.linear_fraction > initial_soc,
+            delta_soc_linear * capacity / power,
+            0,
+            )
+
+        delta_soc_exponential = final_soc - np.maximum(initial_soc, self.linear_fraction)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+            duration_exponential = np.where(
+                self.linear_fraction < final_soc,
+                -np.log(
+                    1 - delta_soc_exponential / (1 - self.linear_fraction)
+                    ) / alpha,
+                0,
+                )
+
+        return duration_linear + duration_exponential
+
     def ac_charge(self, initial_soc, final_soc, power, capacity):
         
         duration_linear = (final_soc - initial_soc) * capacity / power
@@ -504,6 +1354,66 @@ class Vehicle():
 
             return feasible, edge_energy, charge_duration
 
+    def energy_array(self, station_power, station_dc, distance, to_station):
+        '''
+        Vectorized energy over edges
+
+        station_power - power of the source station of each edge
+        station_dc - True where the source station of each edge is dc
+        distance - distance of each edge
+        to_station - True where the target of each edge is a station
+        '''
+
+        power = np.minimum(self.power, station_power)
+
+        edge_energy = self.consumption * distance
+
+        initial_soc = self.soc_bounds[0]
+
+        final_soc = initial_soc + edge_energy / self.capacity
+
+        feasible = in_range(
+            distance,
+            np.where(to_station, self.min_edge_distance, 0),
+            self.range,
+            )
+
+        charge_duration = np.where(
+            station_dc,
+            self.dc_charge_array(initial_soc, final_soc, power, self.capacity),
+            self.ac_charge(initial_soc, final_soc, power, self.capacity),
+            )
+
+        charge_duration_infeasible = np.where(
+            station_dc,
+            self.dc_charge_array(
+                self.soc_bounds[0], self.soc_bounds[1], power, self.usable_capacity
+                ),
+            self.ac_charge(
+                self.soc_bounds[0], self.soc_bounds[1], power, self.usable_capacity
+                ),
+            ) + self.out_of_charge_penalty
+
+        charge_duration = np.where(feasible, charge_duration, charge_duration_infeasible)
+
+        return feasible, edge_energy, charge_duration
+
+class CaseView(Vehicle):
+    '''
+    Lightweight view of a Vehicle with expectation Case(case)
+
+    Attributes are shared with the vehicle rather than deep-copied. To evaluate every
+    case see lanes.case_all_pairs_shortest_paths.
+    '''
+
+    def __init__(self, vehicle, case):
+
+        self.__dict__.update(vehicle.__dict__)
+
+        self.vehicle = vehicle
+        self.case = case
+        self.expectation = Case(case)
+
 class Station():
 
     def __init__(self, node = {}, **kwargs):
@@ -545,6 +1455,9 @@ class Station():
         self.setup_time = kwargs.get('setup_time', 0) # [s]
 
         self.queue_kw = kwargs.get('queue', {})
+
+        # Shared cache of queuing time distributions, None to disable caching
+        self.queue_cache = kwargs.get('queue_cache', queuing_cache)
         
         self.vehicle = None
         self.delay_time = None
@@ -558,13 +1471,21 @@ class Station():
 
                 rho = np.linspace(*self.vehicle.risk_attitude, 100)
 
-                self.queue_time = queuing_time_distribution(
+                if self.queue_cache is None:
+
+                    distribution = queuing_time_distribution
+
+                else:
+
+                    distribution = self.queue_cache.get
+
+                self.queue_time = distribution(
                     self.usable_ports, rho, self.power, **self.queue_kw,
                     ).rvs(size = self.cases, random_state = self.rng)
 
                 if self.usable_ports != self.ports:
 
-                    self.queue_time_nominal = queuing_time_distribution(
+                    self.queue_time_nominal = distribution(
                         self.ports, rho, self.power, **self.queue_kw,
                         ).rvs(size = self.cases, random_state = self.rng)
                 else:
@@ -623,4 +1544,313 @@ class Station():
         edge['total_time'] = edge['time'] + delay_time + charge_duration
         edge['routing_time'] = edge['time'] + delay_time_nominal + charge_duration
 
-        return edge
\ No newline at end of file
+        return edge
+
+def _table_row(name):
+    '''
+    Property reading attribute name of a StationTable at the row of a TableStation
+    '''
+
+    return property(lambda self: getattr(self.table, name)[self.idx])
+
+class TableStation():
+    '''
+    Station-compatible view of one row of a StationTable
+
+    Implements the Station interface (the Station attributes, estimate, and update)
+    without running Station.__init__, which would draw power and usable ports anew.
+    Attributes are read through to the table's arrays so a view always reflects the
+    table's latest estimate, including one made through another view. vehicle is the
+    vehicle the table last estimated for.
+    '''
+
+    type = _table_row('type')
+    access = _table_row('access')
+    cases = _table_row('cases')
+    power = _table_row('power')
+    price = _table_row('price')
+    reliability = _table_row('reliability')
+    ports = _table_row('ports')
+    usable_ports = _table_row('usable_ports')
+    setup_time = _table_row('setup_time')
+    queue_kw = _table_row('queue_kw')
+
+    queue_time = _table_row('queue_time')
+    queue_time_nominal = _table_row('queue_time_nominal')
+    delay_time = _table_row('delay_time')
+    delay_time_expected = _table_row('delay_time_expected')
+    delay_time_nominal = _table_row('delay_time_nominal')
+    delay_time_nominal_expected = _table_row('delay_time_nominal_expected')
+
+    def __init__(self, table, idx):
+
+        self.table = table
+        self.idx = idx
+
+        # Vehicle set by Station.update before estimate is called
+        self._vehicle = None
+
+    @property
+    def queue_cache(self):
+
+        return self.table.queue_cache
+
+    @property
+    def rng(self):
+
+        return self.table.rng
+
+    @property
+    def vehicle(self):
+
+        return self.table.vehicle
+
+    @vehicle.setter
+    def vehicle(self, vehicle):
+
+        self._vehicle = vehicle
+
+    def estimate(self):
+
+        self.table.estimate(self._vehicle)
+
+    def update(self, vehicle, edge):
+
+        return Station.update(self, vehicle, edge)
+
+class StationTable():
+    '''
+    Station attributes for every station node of a graph
+
+    Attributes are generated with array operations from a single random stream so that
+    a table is reproducible from one seed. Usable ports are binomially distributed and
+    delays are sampled for all stations in one pass per node type when the vehicle
+    changes. stations() returns TableStation views which can be used wherever Station
+    objects are used (supply_costs and Overlay accept a StationTable in place of
+    station_kw).
+
+    args:
+
+    graph - graph whose nodes are typed
+    station_kw - dictionary of Station kwargs keyed by node type. Keys seed and rng
+    are ignored in favor of the table's generator
+
+    kwargs:
+
+    seed - seed for the table's generator
+    rng - generator, overrides seed
+    queue_cache - QueuingCache or None to disable caching
+    '''
+
+    def __init__(self, graph, station_kw, **kwargs):
+
+        self.rng = kwargs.get('rng', np.random.default_rng(kwargs.get('seed', None)))
+        self.queue_cache = kwargs.get('queue_cache', queuing_cache)
+
+        self.nodes = [
+            k for k, v in graph._node.items() if v.get('type', None) in station_kw
+            ]
+
+        self.index = {k: idx for idx, k in enumerate(self.nodes)}
+
+        n = len(self.nodes)
+
+        node_type = np.array([graph._node[k]['type'] for k in self.nodes], dtype = object)
+
+        self.node_type = node_type
+
+        self.type = np.empty(n, dtype = object)
+        self.access = np.empty(n, dtype = object)
+        self.cases = np.ones(n, dtype = int)
+        self.power = np.full(n, np.inf)
+        self.price = np.zeros(n)
+        self.reliability = np.ones(n)
+        self.ports = np.ones(n, dtype = int)
+        self.setup_time = np.zeros(n)
+        self.queue_kw = np.empty(n, dtype = object)
+
+        self.groups = {}
+
+        for key, kw in station_kw.items():
+
+            rows = np.flatnonzero(node_type == key)
+
+            self.groups[key] = rows
+
+            if rows.size == 0:
+
+                continue
+
+            self.type[rows] = kw.get('type', 'ac')
+            self.access[rows] = kw.get('access', 'private')
+            self.cases[rows] = kw.get('cases', 1)
+            self.price[rows] = kw.get('price', .5 / 3.6e6)
+            self.reliability[rows] = kw.get('reliability', 1)
+            self.setup_time[rows] = kw.get('setup_time', 0)
+
+            for row in rows:
+
+                self.queue_kw[row] = kw.get('queue', {})
+
+            if 'ports' in kw:
+
+                self.ports[rows] = kw['ports']
+
+            else:
+
+                self.ports[rows] = [
+                    graph._node[self.nodes[row]].get('n_dcfc', 1) for row in rows
+                    ]
+
+            power = kw.get('power', np.inf)
+
+            if type(power) == dict:
+
+                network = np.array(
+                    [graph._node[self.nodes[row]].get('network', '') for row in rows],
+                    dtype = object,
+                    )
+
+                for name in np.unique(network):
+
+                    selected = rows[network == name]
+
+                    self.power[selected] = self.rng.choice(
+                        power.get(name, power['default']), size = selected.size
+                        )
+
+            else:
+
+                self.power[rows] = power
+
+        self.usable_ports = self.rng.binomial(self.ports, self.reliability)
+
+        self.vehicle = None
+
+        # Estimated attributes are None until estimate is called as for Station
+        for name in (
+            'queue_time', 'queue_time_nominal', 'delay_time', 'delay_time_expected',
+            'delay_time_nominal', 'delay_time_nominal_expected',
+            ):
+
+            setattr(self, name, np.full(n, None, dtype = object))
+
+        self.views = {
+            node: TableStation(self, idx) for idx, node in enumerate(self.nodes)
+            }
+
+    def estimate(self, vehicle):
+        '''
+        Samples queuing times for all stations for vehicle (once per vehicle)
+        '''
+
+        if vehicle is self.vehicle:
+
+            return
+
+        self.vehicle = vehicle
+
+        n = len(self.nodes)
+
+        rho = np.linspace(*vehicle.risk_attitude, 100)
+
+        if self.queue_cache is None:
+
+            distribution = queuing_time_distribution
+
+        else:
+
+            distribution = self.queue_cache.get
+
+        self.queue_time = np.empty(n, dtype = object)
+        self.queue_time_nominal = np.empty(n, dtype = object)
+
+        self.delay_time = np.empty(n, dtype = object)
+        self.delay_time_nominal = np.empty(n, dtype = object)
+
+        self.delay_time_expected = np.zeros(n)
+        self.delay_time_nominal_expected = np.zeros(n)
+
+        for key, rows in self.groups.items():
+
+            if rows.size == 0:
+
+                continue
+
+            cases = self.cases[rows[0]]
+
+            queue_time = np.zeros((rows.size, cases))
+            queue_time_nominal = np.zeros((rows.size, cases))
+
+            if self.access[rows[0]] == 'public':
+
+                queue_kw = self.queue_kw[rows[0]]
+
+                usable = self.usable_ports[rows] > 0
+                degraded = usable & (self.usable_ports[rows] != self.ports[rows])
+
+                # Distributions are looked up once per (ports, power) combination
+                combinations = {}
+
+                def sampler(ports, power):
+
+                    if (ports, power) not in combinations:
+
+                        combinations[(ports, power)] = distribution(
+                            ports, rho, power, **queue_kw
+                            )
+
+                    return combinations[(ports, power)]
+
+                samplers = [
+                    sampler(self.usable_ports[row], self.power[row])
+                    for row in rows[usable]
+                    ]
+
+                queue_time[usable] = sample_queuing_times(
+                    samplers, size = cases, random_state = self.rng
+                    )
+
+                samplers = [
+                    sampler(self.ports[row], self.power[row]) for row in rows[degraded]
+                    ]
+
+                queue_time_nominal[usable] = queue_time[usable]
+
+                queue_time_nominal[degraded] = sample_queuing_times(
+                    samplers, size = cases, random_state = self.rng
+                    )
+
+                queue_time[~usable] = np.inf
+                queue_time_nominal[~usable] = np.inf
+
+            delay_time = queue_time + self.setup_time[rows, None]
+            delay_time_nominal = queue_time_nominal + self.setup_time[rows, None]
+
+            for idx, row in enumerate(rows):
+
+                self.queue_time[row] = queue_time[idx]
+                self.queue_time_nominal[row] = queue_time_nominal[idx]
+
+                self.delay_time[row] = delay_time[idx]
+                self.delay_time_nominal[row] = delay_time_nominal[idx]
+
+            self.delay_time_expected[rows] = np.median(delay_time, axis = 1)
+            self.delay_time_nominal_expected[rows] = np.median(
+                delay_time_nominal, axis = 1
+                )
+
+    def station(self, node):
+        '''
+        Returns the TableStation view of the station at node. There is one view per
+        node which reads through to the table.
+        '''
+
+        return self.views[node]
+
+    def stations(self):
+        '''
+        Returns a dictionary of the TableStation views keyed by node
+        '''
+
+        return dict(self.views)
@@ -0,0 +1,498 @@
+'''
+Module for state of charge (SOC) aware routing
+
+Vehicle.energy assumes that every charge event starts at soc_bounds[0] and adds just
+enough energy for the next edge so SOC is not part of the routing label. The
+label-setting engine in this module instead carries the arrival SOC of each label,
+discretized into buckets, and lets the vehicle choose how much to charge at each
+station. Labels are created by driving an edge (SOC falls by the bucketed edge energy,
+rounded up) or by charging at a station (SOC rises to any higher bucket at the cost of
+the station delay, the charging time, and the price of the energy).
+
+Labels are settled in order of cost (vehicle.cost time plus price_weight times price).
+A label is dominated if a label already settled at its node has at least its SOC (and,
+if pareto is True, at most its price). Both checks are constant time using per-node
+arrays indexed by SOC bucket: the highest SOC settled and the lowest price settled at
+or above each SOC (a suffix minimum). Dominated labels are pruned when created and
+again when popped.
+
+Stations must be attached to nodes (see supply_costs and overlay.py). Edge resupply
+costs written by supply_costs are not used.
+'''
+import time
+import heapq
+
+import numpy as np
+
+from numba import jit
+
+from .progress_bar import ProgressBar
+from .lanes import csr_from_adjacency
+
+# Columns of the label value array
+_value_fields = (
+    'cost', 'total_time', 'routing_time', 'driving_time', 'charging_time', 'distance',
+    'price',
+    )
+
+def soc_arrays(graph, vehicle, buckets = 21):
+    '''
+    Packs a graph with stations into CSR and station arrays for SOC-aware routing
+
+    Returns a dictionary holding nodes, index, the CSR indptr and indices, per-edge
+    time, distance, price, and SOC buckets consumed (-1 where the edge exceeds the
+    usable capacity) with the out-edges of each node sorted by SOC consumed, and
+    per-node station group, delays, and price per bucket with a (groups, buckets,
+    buckets) charging time table.
+    '''
+
+    nodes, index, indptr, indices = csr_from_adjacency(graph)
+
+    soc = np.linspace(*vehicle.soc_bounds, buckets)
+    step = soc[1] - soc[0]
+
+    edge_time = np.zeros(len(indices))
+    edge_distance = np.zeros(len(indices))
+    edge_price = np.zeros(len(indices))
+
+    idx = 0
+
+    for source, adj in graph._adj.items():
+        for target, edge in adj.items():
+
+            edge_time[idx] = edge['time']
+            edge_distance[idx] = edge['distance']
+            edge_price[idx] = edge.get('price', 0)
+
+            idx += 1
+
+    with np.errstate(invalid = 'ignore'):
+
+        edge_buckets = np.ceil(
+            vehicle.consumption * edge_distance / vehicle.capacity / step - 1e-9
+            )
+
+    edge_buckets = np.where(
+        np.isfinite(edge_buckets) & (edge_buckets <= buckets - 1), edge_buckets, -1
+        ).astype(np.int64)
+
+    # Out-edges of each node in order of SOC consumed so that scans stop at the first
+    # edge which cannot be driven
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+
+    order = np.lexsort((np.where(edge_buckets < 0, buckets, edge_buckets), sources))
+
+    indices = indices[order]
+    edge_time = edge_time[order]
+    edge_distance = edge_distance[order]
+    edge_price = edge_price[order]
+    edge_buckets = edge_buckets[order]
+
+    station_group = -np.ones(len(nodes), dtype = np.int64)
+    delay_routing = np.zeros(len(nodes))
+    delay_total = np.zeros(len(nodes))
+    bucket_price = np.zeros(len(nodes))
+
+    groups = {}
+
+    for idx, node in enumerate(nodes):
+
+        station = graph._node[node].get('station', None)
+
+        if station is None:
+
+            continue
+
+        if vehicle is not station.vehicle:
+
+            station.vehicle = vehicle
+
+            station.estimate()
+
+        # Stations with unlimited power neither delay nor take time to charge
+        if station.power == np.inf:
+
+            key = (np.inf, 'none')
+
+        else:
+
+            key = (min([vehicle.power, station.power]), station.type)
+
+            delay_routing[idx] = station.delay_time_nominal_expected
+            delay_total[idx] = station.delay_time_expected
+
+        station_group[idx] = groups.setdefault(key, len(groups))
+        bucket_price[idx] = station.price * step * vehicle.capacity
+
+    charge_time = np.zeros((max([len(groups), 1]), buckets, buckets))
+
+    initial_soc, final_soc = soc[:, None], soc[None, :]
+
+    for (power, station_type), group in groups.items():
+
+        if station_type == 'dc':
+
+            duration = vehicle.dc_charge_array(
+                initial_soc, final_soc, power, vehicle.capacity
+                )
+
+        elif station_type == 'ac':
+
+            duration = vehicle.ac_charge(initial_soc, final_soc, power, vehicle.capacity)
+
+        else:
+
+            duration = np.zeros((buckets, buckets))
+
+        charge_time[group] = np.where(final_soc > initial_soc, duration, 0)
+
+    arrays = {
+        'nodes': nodes,
+        'index': index,
+        'soc': soc,
+        'indptr': indptr,
+        'indices': indices,
+        'edge_time': edge_time,
+        'edge_distance': edge_distance,
+        'edge_price': edge_price,
+        'edge_buckets': edge_buckets,
+        'station_group': station_group,
+        'delay_routing': delay_routing,
+        'delay_total': delay_total,
+        'bucket_price': bucket_price,
+        'charge_time': charge_time,
+        }
+
+    return arrays
+
+def soc_all_pairs_shortest_paths(graph, origins, vehicle, **kwargs):
+    '''
+    SOC-aware routing between all origins
+
+    args:
+
+    graph - graph or Overlay with stations attached to nodes
+    origins - nodes routed between. Other origins are reached but not expanded.
+    vehicle - Vehicle with cases = 1
+
+    kwargs:
+
+    buckets - number of SOC buckets spanning vehicle.soc_bounds
+    initial_soc - SOC at the origin, defaults to soc_bounds[1]
+    final_soc - minimum SOC on arrival, defaults to soc_bounds[0]
+    price_weight - time equivalent of price [s/$] added to the cost, defaults to 0
+    pareto - if True labels are also compared on price
+    return_paths - if False paths and charge events are not returned
+    info - optional dictionary which is updated with label counts, pruning rates,
+    and (if return_paths) the charge events (station, initial SOC, final SOC) of each
+    path keyed by origin and then destination
+
+    Returns costs, values, and paths as nested dictionaries keyed by origin and then
+    destination in the same format as all_pairs_shortest_paths. values hold the
+    fields of Vehicle labels and the arrival SOC.
+    '''
+
+    buckets = kwargs.get('buckets', 21)
+    initial_soc = kwargs.get('initial_soc', vehicle.soc_bounds[1])
+    final_soc = kwargs.get('final_soc', vehicle.soc_bounds[0])
+    price_weight = kwargs.get('price_weight', 0)
+    pareto = kwargs.get('pareto', False)
+    return_paths = kwargs.get('return_paths', True)
+
+    if vehicle.cases > 1:
+
+        raise ValueError(
+            'SOC-aware routing requires a vehicle with cases = 1'
+            )
+
+    t0 = time.time()
+
+    arrays = soc_arrays(graph, vehicle, buckets)
+
+    nodes, index, soc = arrays['nodes'], arrays['index'], arrays['soc']
+
+    step = soc[1] - soc[0]
+
+    initial_bucket = int(np.floor((initial_soc - soc[0]) / step + 1e-9))
+    final_bucket = int(np.ceil((final_soc - soc[0]) / step - 1e-9))
+
+    terminal = np.zeros(len(nodes), dtype = np.bool_)
+    terminal[[index[o] for o in origins]] = True
+
+    costs = {}
+    values = {}
+    paths = {}
+    charges = {}
+
+    counts = {
+        'created': 0,
+        'pruned_created': 0,
+        'pruned_settled': 0,
+        'settled': 0,
+        }
+
+    for origin in ProgressBar(origins, **kwargs.get('progress_bar_kw', {})):
+
+        best, data, meta, counters = _soc_label_setting(
+            arrays['indptr'], arrays['indices'],
+            arrays['edge_time'], arrays['edge_distance'], arrays['edge_price'],
+            arrays['edge_buckets'], arrays['station_group'],
+            arrays['delay_routing'], arrays['delay_total'],
+            arrays['bucket_price'], arrays['charge_time'],
+            terminal, index[origin], initial_bucket, final_bucket,
+            price_weight, vehicle.cost == 'routing_time', pareto,
+            )
+
+        for key, count in zip(counts.keys(), counters):
+
+            counts[key] += int(count)
+
+        costs[origin] = {}
+        values[origin] = {}
+        paths[origin] = {}
+        charges[origin] = {}
+
+        for destination in origins:
+
+            label = best[index[destination]]
+
+            if label < 0:
+
+                continue
+
+            costs[origin][destination] = data[label, 0]
+
+            values[origin][destination] = {
+                field: np.array([data[label, idx]])
+                for idx, field in enumerate(_value_fields) if field != 'cost'
+                }
+
+            values[origin][destination]['soc'] = np.array([soc[meta[label, 1]]])
+
+            if return_paths:
+
+                path, events = _label_path(meta, label)
+
+                paths[origin][destination] = [nodes[k] for k in path]
+
+                charges[origin][destination] = [
+                    (nodes[k], soc[b0], soc[b1]) for k, b0, b1 in events
+                    ]
+
+    info = kwargs.get('info', {})
+
+    info.update(counts)
+
+    info['pruning_rate'] = (
+        (info['pruned_created'] + info['pruned_settled']) / max([info['created'], 1])
+        )
+
+    info['labels_per_origin'] = info['created'] / max([len(origins), 1])
+    info['time'] = time.time() - t0
+
+    if return_paths:
+
+        info['charges'] = charges
+
+    else:
+
+        paths = None
+
+    return costs, values, paths
+
+def _label_path(meta, label):
+    '''
+    Recovers the node indices and charge events (node, initial bucket, final bucket)
+    of a label by walking back through its parents
+    '''
+
+    path = []
+    events = []
+
+    while label >= 0:
+
+        node, bucket, parent, kind = meta[label]
+
+        if kind == 2:
+
+            events.append((node, meta[parent, 1], bucket))
+
+        elif (not path) or (path[-1] != node):
+
+            path.append(node)
+
+        label = parent
+
+    return path[::-1], events[::-1]
+
+@jit(nopython = True, cache = True)
+def _dominated(max_soc, best_price, pareto, node, bucket, price):
+
+    if pareto:
+
+        return best_price[node, bucket] <= price
+
+    return max_soc[node] >= bucket
+
+@jit(nopython = True, cache = True)
+def _soc_label_setting(
+    indptr, indices, edge_time, edge_distance, edge_price, edge_buckets,
+    station_group, delay_routing, delay_total, bucket_price, charge_time,
+    terminal, origin, initial_bucket, final_bucket, price_weight, routing_cost, pareto,
+    ):
+    '''
+    Single-origin label-setting over (cost, price, SOC bucket) labels
+
+    Labels are rows of data (see _value_fields) and meta (node, bucket, parent, kind
+    where kind is 0 for the origin, 1 for driving, and 2 for charging). Returns the
+    label settled first at each terminal node with at least final_bucket SOC (-1 if
+    none, 0 for the origin), data, meta, and counters (created, pruned when created,
+    pruned when settled, settled).
+    '''
+
+    n = len(indptr) - 1
+    buckets = charge_time.shape[1]
+
+    max_soc = -np.ones(n, dtype = np.int64)
+    best_price = np.full((n, buckets), np.inf)
+    best = -np.ones(n, dtype = np.int64)
+    best[origin] = 0
+
+    remaining = 0
+
+    for node in range(n):
+
+        if terminal[node] and (node != origin):
+
+            remaining += 1
+
+    data = np.zeros((1024, 7))
+    meta = np.zeros((1024, 4), dtype = np.int64)
+
+    meta[0, 0] = origin
+    meta[0, 1] = initial_bucket
+    meta[0, 2] = -1
+    meta[0, 3] = 0
+
+    count = 1
+
+    counters = np.zeros(4, dtype = np.int64)
+    counters[0] = 1
+
+    heap = [(0., 0)]
+
+    while heap:
+
+        key, label = heapq.heappop(heap)
+
+        node = meta[label, 0]
+        bucket = meta[label, 1]
+        price = data[label, 6]
+
+        if _dominated(max_soc, best_price, pareto, node, bucket, price):
+
+            counters[2] += 1
+
+            continue
+
+        counters[3] += 1
+
+        if bucket > max_soc[node]:
+
+            max_soc[node] = bucket
+
+        for k in range(bucket + 1):
+
+            if price < best_price[node, k]:
+
+                best_price[node, k] = price
+
+        if terminal[node] and (node != origin):
+
+            if (best[node] < 0) and (bucket >= final_bucket):
+
+                best[node] = label
+
+                remaining -= 1
+
+                if remaining == 0:
+
+                    break
+
+            continue
+
+        # Candidate labels as (node, bucket, kind, edge or final bucket)
+        candidates = []
+
+        if (station_group[node] >= 0) and (meta[label, 3] != 2):
+
+            delay = delay_routing[node] if routing_cost else delay_total[node]
+
+            if delay < np.inf:
+
+                for final in range(bucket + 1, buckets):
+
+                    candidates.append((node, final, 2, final))
+
+        for idx in range(indptr[node], indptr[node + 1]):
+
+            if (edge_buckets[idx] < 0) or (edge_buckets[idx] > bucket):
+
+                break
+
+            candidates.append((indices[idx], bucket - edge_buckets[idx], 1, idx))
+
+        for target, target_bucket, kind, item in candidates:
+
+            row = data[label].copy()
+
+            if kind == 2:
+
+                duration = charge_time[station_group[node], bucket, item]
+                energy_price = bucket_price[node] * (item - bucket)
+
+                row[1] += delay_total[node] + duration
+                row[2] += delay_routing[node] + duration
+                row[4] += duration
+                row[6] += energy_price
+
+            else:
+
+                row[1] += edge_time[item]
+                row[2] += edge_time[item]
+                row[3] += edge_time[item]
+                row[5] += edge_distance[item]
+                row[6] += edge_price[item]
+
+            row[0] = (row[2] if routing_cost else row[1]) + price_weight * row[6]
+
+            counters[0] += 1
+
+            if _dominated(max_soc, best_price, pareto, target, target_bucket, row[6]):
+
+                counters[1] += 1
+
+                continue
+
+            if count == data.shape[0]:
+
+                grown = np.zeros((2 * count, 7))
+                grown[:count] = data
+                data = grown
+
+                grown_meta = np.zeros((2 * count, 4), dtype = np.int64)
+                grown_meta[:count] = meta
+                meta = grown_meta
+
+            data[count] = row
+
+            meta[count, 0] = target
+            meta[count, 1] = target_bucket
+            meta[count, 2] = label
+            meta[count, 3] = kind
+
+            heapq.heappush(heap, (row[0], count))
+
+            count += 1
+
+    return best, data[:count], meta[:count], counters
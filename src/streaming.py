@@ -0,0 +1,284 @@
+'''
+Module for streaming all-pairs routing results
+
+all_pairs_shortest_paths holds the results of every origin in memory until routing is
+finished. iter_all_pairs_shortest_paths yields the results of each origin as it
+finishes and stream_all_pairs passes them to sinks which write them to disk or reduce
+them on the fly. A sink is any object with an update(origin, costs, values, paths)
+method.
+
+sinks = [NpzSink('results/', origins), GravityAccumulator(origins)]
+
+stream_all_pairs(graph, origins, sinks, objective = vehicle)
+
+gravity = sinks[1].result()
+'''
+import os
+import json
+
+import numpy as np
+
+from .graph import NpEncoder
+from .results import AllPairsResults
+from .routing import iter_all_pairs_shortest_paths, expectation_along_cases
+
+def stream_all_pairs(graph, origins, sinks, method = 'dijkstra', **kwargs):
+    '''
+    Routes from each origin to all origins and passes each origin's results to every
+    sink as it finishes. kwargs are passed to iter_all_pairs_shortest_paths.
+
+    Returns sinks
+    '''
+
+    results = iter_all_pairs_shortest_paths(graph, origins, method = method, **kwargs)
+
+    for origin, costs, values, paths in results:
+
+        for sink in sinks:
+
+            sink.update(origin, costs, values, paths)
+
+    return sinks
+
+class NpzSink():
+    '''
+    Writes the results of each origin to its own .npz file in directory
+
+    args:
+
+    directory - output directory which is created if needed
+    destinations - destination ids for the destination axis of every file, usually
+    the routed origins
+    paths - if True and paths were returned the paths of each origin are written to a
+    .json file alongside the .npz file
+
+    Files are named origin_<k>.npz in the order in which origins finish and can be
+    read back into one AllPairsResults with load_npz_sink. The destination, field, and
+    case axes shared by all files are written to sink.json. Origins which reach no
+    destination are written with empty field and case axes.
+    '''
+
+    def __init__(self, directory, destinations, paths = True):
+
+        self.directory = directory
+        self.destinations = list(destinations)
+        self.paths = paths
+
+        self.fields = None
+        self.cases = None
+        self.count = 0
+
+        os.makedirs(directory, exist_ok = True)
+
+        self._write_metadata()
+
+    def _write_metadata(self):
+
+        metadata = {
+            'destinations': self.destinations,
+            'fields': self.fields,
+            'cases': self.cases,
+        }
+
+        with open(os.path.join(self.directory, 'sink.json'), 'w') as file:
+
+            json.dump(metadata, file, cls = NpEncoder)
+
+    def update(self, origin, costs, values, paths):
+
+        if self.fields is None and values:
+
+            sample = next(iter(values.values()))
+
+            if isinstance(sample, dict):
+
+                self.fields = list(sample.keys())
+                self.cases = len(np.atleast_1d(sample[self.fields[0]]))
+
+            else:
+
+                self.fields = [None]
+                self.cases = len(np.atleast_1d(sample))
+
+            self._write_metadata()
+
+        if values:
+
+            results = AllPairsResults.from_nested(
+                {origin: costs}, {origin: values},
+                origins = [origin],
+                destinations = self.destinations,
+                fields = self.fields,
+                )
+
+        else:
+
+            results = AllPairsResults(
+                np.full((1, len(self.destinations), 0, 0), np.inf),
+                np.full((1, len(self.destinations)), np.inf),
+                [origin], self.destinations, [],
+                )
+
+        filename = os.path.join(self.directory, f'origin_{self.count}')
+
+        results.save(filename + '.npz')
+
+        if self.paths and paths is not None:
+
+            # NpEncoder converts values but not keys and JSON keys must be native
+            paths = {
+                (k.item() if isinstance(k, np.generic) else k): v
+                for k, v in paths.items()
+                }
+
+            with open(filename + '_paths.json', 'w') as file:
+
+                json.dump({'origin': origin, 'paths': paths}, file, cls = NpEncoder)
+
+        self.count += 1
+
+def load_npz_sink(directory):
+    '''
+    Loads the files written by an NpzSink into one AllPairsResults container with
+    origins in the order written. Origins with no reached destinations are filled with
+    infinite values.
+    '''
+
+    with open(os.path.join(directory, 'sink.json'), 'r') as file:
+
+        metadata = json.load(file)
+
+    destinations = metadata['destinations']
+    fields = metadata['fields'] or []
+    cases = metadata['cases'] or 0
+
+    filenames = [f for f in os.listdir(directory) if f.endswith('.npz')]
+
+    filenames = sorted(filenames, key = lambda f: int(f[7:-4]))
+
+    values = np.full((len(filenames), len(destinations), len(fields), cases), np.inf)
+    costs = np.full((len(filenames), len(destinations)), np.inf)
+
+    origins = []
+
+    for idx, filename in enumerate(filenames):
+
+        part = AllPairsResults.load(os.path.join(directory, filename))
+
+        if part.fields:
+
+            values[idx] = part.values[0]
+            costs[idx] = part.costs[0]
+
+        origins.append(part.origins[0])
+
+    return AllPairsResults(values, costs, origins, destinations, fields)
+
+class _Accumulator():
+    '''
+    Incremental accumulator for the pair-sum accessibility metrics
+
+    args:
+
+    origins - dictionary of origin masses or iterable of origin ids (mass 1)
+    destinations - as origins. Defaults to origins.
+
+    kwargs are as in routing.gravity and routing.impedance. Origins which are not in
+    origins are ignored. Unreached destinations take infinite values. The result
+    matches the batch metric once every origin has been passed to update.
+    '''
+
+    def __init__(self, origins, destinations = None, **kwargs):
+
+        if not isinstance(origins, dict):
+
+            origins = {k: 1 for k in origins}
+
+        if destinations is None:
+
+            destinations = origins
+
+        elif not isinstance(destinations, dict):
+
+            destinations = {k: 1 for k in destinations}
+
+        self.origins = origins
+        self.destinations = destinations
+
+        self.destination_ids = list(destinations.keys())
+        self.mass_d = np.array(list(destinations.values()), dtype = float)
+
+        self.field = kwargs.get('field', 'total_time')
+        self.expectation = kwargs.get('expectation', np.mean)
+        self.constant = kwargs.get('constant', 1)
+        self.adjustment = kwargs.get('adjustment', 1)
+
+        self.sum_cost = 0
+        self.n = 0
+
+    def _expected(self, values):
+        '''
+        Returns the expected field value of each destination from one origin
+        '''
+
+        rows = []
+
+        for destination in self.destination_ids:
+
+            pair = values.get(destination, None)
+
+            if pair is None:
+
+                rows.append(None)
+
+            else:
+
+                rows.append(np.atleast_1d(pair[self.field]))
+
+        cases = max([len(r) for r in rows if r is not None], default = 1)
+
+        array = np.vstack(
+            [np.full(cases, np.inf) if r is None else r for r in rows]
+            ) if rows else np.empty((0, cases))
+
+        return expectation_along_cases(self.expectation, array)
+
+    def update(self, origin, costs, values, paths):
+
+        if origin not in self.origins:
+
+            return
+
+        different = np.array([d != origin for d in self.destination_ids], dtype = bool)
+
+        terms = self._terms(self.origins[origin], self._expected(values))
+
+        self.sum_cost += terms[different].sum()
+        self.n += len(self.destination_ids)
+
+    def result(self):
+
+        return self.sum_cost / self.n
+
+class GravityAccumulator(_Accumulator):
+    '''
+    Streaming version of routing.gravity. See _Accumulator for arguments.
+    '''
+
+    def _terms(self, mass_o, expected):
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+            return (
+                self.constant * mass_o * self.mass_d /
+                (expected / self.adjustment) ** 2
+                )
+
+class ImpedanceAccumulator(_Accumulator):
+    '''
+    Streaming version of routing.impedance. See _Accumulator for arguments.
+    '''
+
+    def _terms(self, mass_o, expected):
+
+        return self.constant * mass_o * self.mass_d * expected
@@ -1,6 +1,7 @@
 import sys
 import time
 import numpy as np
+import multiprocessing as mp
 
 from shutil import get_terminal_size
 
@@ -79,6 +80,28 @@ def full_factorial(levels):
 
     return h.astype(int)
 
+def process_pool(processes, initializer, initargs):
+    '''
+    Starts a process pool whose workers are set up by initializer(*initargs)
+
+    The start method is looked up without fixing it for the whole process. Forked
+    workers inherit state set up in the parent so initializer is run once in the
+    parent, otherwise it is run in each worker and initargs are pickled once per
+    worker. The caller is responsible for clearing state set up by initializer.
+    '''
+
+    context = mp.get_context(
+        mp.get_start_method(allow_none = True) or mp.get_all_start_methods()[0]
+        )
+
+    if context.get_start_method() == 'fork':
+
+        initializer(*initargs)
+
+        return context.Pool(processes)
+
+    return context.Pool(processes, initializer = initializer, initargs = initargs)
+
 def pythagorean(source_x, source_y, target_x, target_y):
 
     return np.sqrt((target_x - source_x) ** 2 + (target_y - source_y) ** 2)